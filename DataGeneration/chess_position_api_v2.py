@@ -8,12 +8,21 @@ Strategy:
 
 Usage:
     blender chess-set.blend --background --python chess_position_api_v2.py -- --fen "r4rk1/1p1bqppp/n1p1pn2/p2pN3/2PP4/P1N3P1/1P1QPPBP/R4RK1" --view black
+
+Whole game in one session (only changed pieces move between positions):
+    blender chess-set.blend --background --python chess_position_api_v2.py -- --fen-file game_fens.txt --view white
+    (add --animate to render it as one animation pass per camera -> frame_XXXXXX.png)
+
+Render worker (scene loaded once, jobs over stdin - see render_worker.py):
+    blender chess-set.blend --background --python chess_position_api_v2.py -- --serve --resolution 1024 --samples 16
 """
 
 import bpy
 import math
+import os
 from mathutils import Vector
 import sys
+import json
 import argparse
 # Rotate the offset vector
 from mathutils import Matrix
@@ -27,6 +36,8 @@ LENS = 26
 RES = 1024
 SAMPLES = 128
 OUT_DIR = "//renders"
+# Prefix of the reply lines in --serve mode (kept in sync with render_worker.py)
+RESULT_PREFIX = "@@RENDER_RESULT "
 
 def get_board_info():
     """Get board dimensions"""
@@ -226,18 +237,121 @@ def apply_fen(fen, starting_pieces, board_info):
     
     print(f"\n✓ Position set ({len(pieces_used)} pieces visible)")
 
-def render_all_views(board_info, view='black'):
-    """Render views from white or black perspective"""
-    print("\n" + "="*70)
-    print(f"RENDERING ({view.upper()} VIEW)")
-    print("="*70)
-    
+def square_offset(from_square, to_square, square_size):
+    """Location offset that moves a piece between squares: +X for files right, -Y for ranks up"""
+    file_diff = (ord(to_square[0]) - ord('a')) - (ord(from_square[0]) - ord('a'))
+    rank_diff = int(to_square[1]) - int(from_square[1])
+    return -file_diff * square_size, -rank_diff * square_size
+
+def build_piece_index(starting_pieces):
+    """
+    Persistent piece->square index of the live scene, used by apply_fen_incremental.
+    Right after setup_scene every piece stands visible on its detected starting square.
+    """
+    on_square = {}
+    hidden = {}
+    for piece_name, info in starting_pieces.items():
+        if info['square'] in on_square:
+            # two pieces detected on one square: keep the second one in reserve
+            hidden.setdefault(info['piece_type'], set()).add(piece_name)
+            set_piece_visible(piece_name, False)
+            continue
+        on_square[info['square']] = piece_name
+    return {'on_square': on_square, 'hidden': hidden}
+
+def set_piece_visible(piece_name, visible):
+    obj = bpy.data.objects.get(piece_name)
+    if obj:
+        obj.hide_render = not visible
+        obj.hide_viewport = not visible
+
+def place_piece(piece_name, square, starting_pieces, board_info):
+    """Put a piece on a square (absolute, from its start position - no drift across moves)"""
+    obj = bpy.data.objects.get(piece_name)
+    if obj is None:
+        return
+    info = starting_pieces[piece_name]
+    dx, dy = square_offset(info['square'], square, board_info['square_size'])
+    obj.location = info['start_pos'].copy()
+    obj.location.x += dx
+    obj.location.y += dy
+    set_piece_visible(piece_name, True)
+
+def square_distance(a, b):
+    return abs(ord(a[0]) - ord(b[0])) + abs(int(a[1]) - int(b[1]))
+
+def apply_fen_incremental(fen, piece_index, starting_pieces, board_info):
+    """
+    Move the scene from its current position to `fen`, touching only the squares that changed.
+    Cost is O(changed squares) instead of apply_fen's scan over every piece for every square.
+    Returns the names of the pieces that were moved, shown or hidden.
+    """
+    target = parse_fen(fen)
+    on_square = piece_index['on_square']
+    hidden = piece_index['hidden']
+    
+    def type_on(square):
+        name = on_square.get(square)
+        return starting_pieces[name]['piece_type'] if name else None
+    
+    changed = [sq for sq in set(on_square) | set(target) if type_on(sq) != target.get(sq)]
+    
+    # Lift pieces off the squares that change; they are the first candidates to move
+    lifted = {}
+    touched = []
+    for sq in changed:
+        name = on_square.pop(sq, None)
+        if name:
+            lifted.setdefault(starting_pieces[name]['piece_type'], []).append((sq, name))
+            touched.append(name)
+    
+    for sq in changed:
+        piece_type = target.get(sq)
+        if piece_type is None:
+            continue
+        pool = lifted.get(piece_type)
+        if pool:
+            # a moved piece: take the closest lifted piece of this type
+            pool.sort(key=lambda item: square_distance(item[0], sq))
+            _, name = pool.pop(0)
+        elif hidden.get(piece_type):
+            # captured piece back on the board (promotion, new game): closest to its start square
+            name = min(hidden[piece_type], key=lambda n: square_distance(starting_pieces[n]['square'], sq))
+            hidden[piece_type].discard(name)
+        else:
+            print(f"  Warning: No piece of type '{piece_type}' available for {sq}")
+            continue
+        place_piece(name, sq, starting_pieces, board_info)
+        on_square[sq] = name
+        touched.append(name)
+    
+    # Lifted pieces that found no square were captured
+    for piece_type, pool in lifted.items():
+        for _, name in pool:
+            set_piece_visible(name, False)
+            hidden.setdefault(piece_type, set()).add(name)
+    
+    print(f"✓ Position set incrementally ({len(changed)} squares changed, {len(on_square)} pieces visible)")
+    return set(touched)
+
+def load_fen_file(path):
+    """One FEN per line (only the board field is used), blank lines skipped"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [l.strip().split()[0] for l in f if l.strip()]
+
+def render_fen_sequence(fens, piece_index, starting_pieces, board_info, view='black', out_dir=None):
+    """Render a list of positions in one Blender session, returns one [3 paths] list per FEN"""
+    all_paths = []
+    for i, fen in enumerate(fens):
+        print(f"\n[{i+1}/{len(fens)}] {fen}")
+        apply_fen_incremental(fen, piece_index, starting_pieces, board_info)
+        all_paths.append(render_all_views(board_info, view=view, out_dir=out_dir, prefix=f"{i:06d}_"))
+    return all_paths
+
+def setup_render(board_info):
+    """Remove old cameras, add the sun if missing and apply the Cycles settings"""
     center = board_info['center']
-    scale_factor = board_info['scale_factor']
-    
-    camera_height = DESIRED_CAMERA_HEIGHT * scale_factor
-    angle_radians = math.radians(DESIRED_ANGLE_DEGREES)
-    horizontal_offset = camera_height * math.tan(angle_radians)
+    camera_height = DESIRED_CAMERA_HEIGHT * board_info['scale_factor']
     
     # Clean cameras
     for obj in bpy.data.objects:
@@ -263,6 +377,15 @@ def render_all_views(board_info, view='black'):
         scene.cycles.device = 'GPU'
     except:
         pass
+
+def camera_views(board_info, view='black'):
+    """[(location, name, point_at_center)] of the 3 cameras plus the z rotation for the view"""
+    center = board_info['center']
+    scale_factor = board_info['scale_factor']
+    
+    camera_height = DESIRED_CAMERA_HEIGHT * scale_factor
+    angle_radians = math.radians(DESIRED_ANGLE_DEGREES)
+    horizontal_offset = camera_height * math.tan(angle_radians)
     
     # Camera positions
     camera_z = center.z + camera_height
@@ -282,59 +405,123 @@ def render_all_views(board_info, view='black'):
             ((center.x + horizontal_offset, center.y, camera_z), "3_east", False),
         ]
         z_rotation_offset = 0
+    return views, z_rotation_offset
+
+def add_camera(board_info, location, name, point_at_center, z_rotation_offset):
+    bpy.ops.object.camera_add(location=location)
+    cam = bpy.context.active_object
+    cam.name = name
+    
+    if point_at_center:
+        direction = board_info['center'] - cam.location
+        cam.rotation_euler = direction.to_track_quat("-Z", "Y").to_euler()
+    else:
+        cam.rotation_euler = (0, 0, 0)
+    
+    # Apply rotation for white/black view
+    cam.rotation_euler.z += z_rotation_offset
+    
+    cam.data.lens = LENS
+    return cam
+
+def render_all_views(board_info, view='black', out_dir=None, prefix=''):
+    """Render views from white or black perspective, returns the written file paths"""
+    print("\n" + "="*70)
+    print(f"RENDERING ({view.upper()} VIEW)")
+    print("="*70)
     
+    setup_render(board_info)
+    views, z_rotation_offset = camera_views(board_info, view)
+    
+    out_dir = out_dir or OUT_DIR
+    paths = []
     for location, name, point_at_center in views:
         print(f"\nRendering: {name}")
         
-        bpy.ops.object.camera_add(location=location)
-        cam = bpy.context.active_object
-        
-        if point_at_center:
-            direction = center - cam.location
-            cam.rotation_euler = direction.to_track_quat("-Z", "Y").to_euler()
-        else:
-            cam.rotation_euler = (0, 0, 0)
-        
-        # Apply rotation for white/black view
-        cam.rotation_euler.z += z_rotation_offset
-        
-        cam.data.lens = LENS
+        cam = add_camera(board_info, location, name, point_at_center, z_rotation_offset)
         
         bpy.context.scene.camera = cam
-        bpy.context.scene.render.filepath = f"{OUT_DIR}/{name}.png"
+        bpy.context.scene.render.filepath = f"{out_dir}/{prefix}{name}.png"
         bpy.ops.render.render(write_still=True)
+        paths.append(os.path.abspath(bpy.path.abspath(f"{out_dir}/{prefix}{name}.png")))
         
-        print(f"  ✓ Saved: {name}.png")
+        print(f"  ✓ Saved: {prefix}{name}.png")
         
         bpy.data.objects.remove(cam, do_unlink=True)
     
     print("\n✓ Rendering complete")
+    return paths
 
-def main():
-    argv = sys.argv
-    if "--" in argv:
-        argv = argv[argv.index("--") + 1:]
-    else:
-        argv = []
+def keyframe_piece(piece_name, frame):
+    obj = bpy.data.objects.get(piece_name)
+    if obj:
+        obj.keyframe_insert("location", frame=frame)
+        obj.keyframe_insert("hide_render", frame=frame)
+        obj.keyframe_insert("hide_viewport", frame=frame)
+
+def render_fen_animation(fens, piece_index, starting_pieces, board_info, view='black', out_dir=None):
+    """
+    Render a whole game as one animation pass per camera.
     
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--fen', type=str, default="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR")
-    parser.add_argument('--resolution', type=int, default=800)
-    parser.add_argument('--samples', type=int, default=128)
-    parser.add_argument('--view', type=str, default='black', choices=['white', 'black'],
-                        help='Render from white or black perspective')
+    Ply i is keyframed (constant interpolation) at timeline frame 3*i and held for 3 frames;
+    camera v (fixed rig, created once) renders frames v, v+3, v+6, ... so every image is written
+    straight to out_dir/frame_{3*i+v:06d}.png - the generators' frame_XXXXXX.png / game.csv layout
+    with 3 views per FEN. Persistent render data keeps the scene/BVH sync between frames.
+    Returns one [overhead, side_2, side_3] path list per FEN.
+    """
+    print("\n" + "="*70)
+    print(f"RENDERING {len(fens)} POSITIONS AS ANIMATION ({view.upper()} VIEW)")
+    print("="*70)
     
-    args = parser.parse_args(argv)
+    scene = bpy.context.scene
+    out_dir = out_dir or OUT_DIR
+    pieces = list(starting_pieces.keys())
+    
+    # Keyframe every piece at ply 0, afterwards only the pieces that changed
+    for i, fen in enumerate(fens):
+        touched = apply_fen_incremental(fen, piece_index, starting_pieces, board_info)
+        for piece_name in (pieces if i == 0 else touched):
+            keyframe_piece(piece_name, frame=3 * i)
+    for piece_name in pieces:
+        obj = bpy.data.objects.get(piece_name)
+        if obj and obj.animation_data and obj.animation_data.action:
+            for fcurve in obj.animation_data.action.fcurves:
+                for kp in fcurve.keyframe_points:
+                    kp.interpolation = 'CONSTANT'
+    
+    setup_render(board_info)
+    views, z_rotation_offset = camera_views(board_info, view)
+    rig = [add_camera(board_info, location, name, point_at_center, z_rotation_offset)
+           for location, name, point_at_center in views]
+    
+    scene.render.use_persistent_data = True
+    scene.render.filepath = f"{out_dir}/frame_######"
+    scene.render.use_file_extension = True
+    last_frame = 3 * (len(fens) - 1)
+    for v, cam in enumerate(rig):
+        print(f"\nRendering camera: {cam.name} ({len(fens)} frames)")
+        scene.camera = cam
+        scene.frame_start = v
+        scene.frame_end = last_frame + v
+        scene.frame_step = 3
+        bpy.ops.render.render(animation=True)
+    
+    # Leave the scene static at the last position so the piece index stays valid for the next job
+    scene.frame_step = 1
+    scene.frame_set(last_frame)
+    for piece_name in pieces:
+        obj = bpy.data.objects.get(piece_name)
+        if obj:
+            obj.animation_data_clear()
+    for cam in rig:
+        bpy.data.objects.remove(cam, do_unlink=True)
     
-    global RES, SAMPLES, OUT_DIR
-    RES = args.resolution
-    SAMPLES = args.samples
-    OUT_DIR = "./renders"
+    print("\n✓ Animation rendering complete")
+    return [[os.path.abspath(bpy.path.abspath(f"{out_dir}/frame_{3 * i + v:06d}.png")) for v in range(3)]
+            for i in range(len(fens))]
 
-    
-    # Get board info
-    board_info = get_board_info()
-    # Fix inverted board - rotate checkerboard 90 degrees around board center
+def fix_board_orientation():
+    """Fix inverted board - rotate checkerboard 90 degrees around board center"""
     plane = bpy.data.objects.get("Black & white")
     if plane:
         # Get board center first (before rotating)
@@ -355,8 +542,106 @@ def main():
         rotated_offset = rot_matrix @ offset
         
         plane.location = center + rotated_offset
+
+def setup_scene():
+    """Load-time scene preparation, done once per Blender process"""
+    # Get board info
+    board_info = get_board_info()
+    fix_board_orientation()
     # Detect starting positions
     starting_pieces = detect_starting_positions(board_info)
+    return board_info, starting_pieces
+
+def reply(msg):
+    """Write one protocol line; Blender's own render log shares this stdout"""
+    sys.stdout.flush()
+    print(RESULT_PREFIX + json.dumps(msg), flush=True)
+
+def serve(board_info, starting_pieces):
+    """
+    Render worker mode: the scene stays loaded and jobs arrive on stdin, one JSON per line.
+
+    Job:   {"fen": "<board fen>", "view": "white"|"black", "out_dir": "<staging dir>"}
+    Reply: RESULT_PREFIX + {"ok": true, "paths": [overhead, side_2, side_3]}
+    Job:   {"fens": ["<board fen>", ...], "view": ..., "out_dir": ..., "animate": false}
+    Reply: RESULT_PREFIX + {"ok": true, "paths": [[overhead, side_2, side_3], ...]}
+           ("animate": true renders the list as one animation pass per camera, see render_fen_animation)
+    Error: RESULT_PREFIX + {"ok": false, "error": "..."}
+    EOF or {"cmd": "quit"} stops the worker.
+    
+    The piece index persists across jobs, so consecutive plies only move the pieces that changed.
+    """
+    piece_index = build_piece_index(starting_pieces)
+    print("\n" + "="*70)
+    print("RENDER WORKER READY")
+    print("="*70)
+    reply({"ok": True, "ready": True})
+    
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+            if job.get('cmd') == 'quit':
+                break
+            view = job.get('view', 'black')
+            if 'fens' in job:
+                render_fens = render_fen_animation if job.get('animate') else render_fen_sequence
+                paths = render_fens(job['fens'], piece_index, starting_pieces, board_info,
+                                    view=view, out_dir=job.get('out_dir'))
+            else:
+                apply_fen_incremental(job['fen'], piece_index, starting_pieces, board_info)
+                paths = render_all_views(board_info, view=view, out_dir=job.get('out_dir'))
+            reply({"ok": True, "paths": paths})
+        except Exception as e:
+            reply({"ok": False, "error": f"{type(e).__name__}: {e}"})
+    
+    print("\n✓ Render worker stopped")
+
+def main():
+    argv = sys.argv
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    else:
+        argv = []
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fen', type=str, default="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR")
+    parser.add_argument('--resolution', type=int, default=800)
+    parser.add_argument('--samples', type=int, default=128)
+    parser.add_argument('--view', type=str, default='black', choices=['white', 'black'],
+                        help='Render from white or black perspective')
+    parser.add_argument('--fen-file', type=str, default=None,
+                        help='Render every FEN in this file (one per line) in this session')
+    parser.add_argument('--animate', action='store_true',
+                        help='With --fen-file: one animation render per camera, written as frame_XXXXXX.png')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep the scene loaded and render FEN/view jobs read from stdin')
+    
+    args = parser.parse_args(argv)
+    
+    global RES, SAMPLES, OUT_DIR
+    RES = args.resolution
+    SAMPLES = args.samples
+    OUT_DIR = "./renders"
+
+    if args.serve:
+        # Arrows/check marks in the log must not kill the worker on a cp1252 pipe
+        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    
+    board_info, starting_pieces = setup_scene()
+    
+    if args.serve:
+        serve(board_info, starting_pieces)
+        return
+    
+    if args.fen_file:
+        fens = load_fen_file(args.fen_file)
+        piece_index = build_piece_index(starting_pieces)
+        render_fens = render_fen_animation if args.animate else render_fen_sequence
+        render_fens(fens, piece_index, starting_pieces, board_info, view=args.view)
+        return
     
     # Apply FEN
     apply_fen(args.fen, starting_pieces, board_info)
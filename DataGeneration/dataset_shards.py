@@ -0,0 +1,165 @@
+"""
+Sharded dataset format: large sequential tar files instead of one PNG per frame.
+
+A shard is a plain tar (readable with tar / webdataset) holding, per sample,
+    <game>_<frame>.png    encoded image bytes
+    <game>_<frame>.json   {"fen", "viewpoint", "view", "game", "frame", "domain"}
+next to a sidecar index <shard>.tar.idx.jsonl with one line per sample (the json
+fields plus the byte offset and size of the PNG inside the tar), so readers can
+list a dataset without touching the image data and fetch any sample with a
+single seek + read.
+
+Writers only append: the index is flushed after every complete game, so a crash
+leaves at most a truncated tail that the index never points to. A game that was
+written twice (killed between the shard write and the ledger update) is
+de-duplicated on load by its key - the last copy wins.
+
+Usage (writer, one per render worker):
+    with ShardWriter(SHARD_DIR, prefix="w00") as writer:
+        writer.write_game([(key, png_bytes, meta), ...])
+
+Usage (reader):
+    records = load_shard_index(SHARD_DIR)
+    reader = ShardReader()
+    png_bytes = reader.read(records[0]["shard"], records[0]["offset"], records[0]["size"])
+"""
+import glob
+import io
+import json
+import os
+import re
+import tarfile
+import time
+
+SHARD_MAX_BYTES = 1024**3
+INDEX_SUFFIX = ".idx.jsonl"
+
+
+class ShardWriter:
+    def __init__(self, out_dir, prefix="shard", max_bytes=SHARD_MAX_BYTES):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.max_bytes = int(max_bytes)
+        self.tar = None
+        self.index = None
+        self.path = None
+
+    def _next_path(self):
+        # Never append to shards of an earlier run: their tail may be truncated
+        ids = []
+        for p in glob.glob(os.path.join(self.out_dir, f"{self.prefix}-*.tar")):
+            m = re.search(r"-(\d{6})\.tar$", p)
+            if m:
+                ids.append(int(m.group(1)))
+        n = (max(ids) + 1) if ids else 0
+        return os.path.join(self.out_dir, f"{self.prefix}-{n:06d}.tar")
+
+    def _open(self):
+        self.path = self._next_path()
+        self.tar = tarfile.open(self.path, "w", format=tarfile.USTAR_FORMAT)
+        self.index = open(self.path + INDEX_SUFFIX, "w", encoding="utf-8")
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        header = info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        offset = self.tar.offset + len(header)
+        self.tar.addfile(info, io.BytesIO(data))
+        return offset
+
+    def write_game(self, samples):
+        """samples: [(key, image_bytes, meta_dict), ...] - all frames of one game, indexed together"""
+        if self.tar is None:
+            self._open()
+        lines = []
+        for key, data, meta in samples:
+            offset = self._add(key + ".png", data)
+            self._add(key + ".json", json.dumps(meta).encode("utf-8"))
+            lines.append(json.dumps({"key": key, **meta, "offset": offset, "size": len(data)}))
+
+        self.tar.fileobj.flush()
+        os.fsync(self.tar.fileobj.fileno())
+        self.index.write("".join(line + "\n" for line in lines))
+        self.index.flush()
+
+        if self.tar.offset >= self.max_bytes:
+            self.close()
+
+    def close(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        self.index.close()
+        self.tar = None
+        self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_shard_index(shard):
+    records = []
+    with open(shard + INDEX_SUFFIX, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # Truncated last line of a shard that was being written
+                continue
+            rec["shard"] = shard
+            records.append(rec)
+    return records
+
+
+def load_shard_index(shard_dir):
+    """All samples of all shards in shard_dir (sorted by key), each with its "shard" path"""
+    records = {}
+    for idx_path in sorted(glob.glob(os.path.join(shard_dir, "*.tar" + INDEX_SUFFIX))):
+        for rec in read_shard_index(idx_path[:-len(INDEX_SUFFIX)]):
+            records[rec["key"]] = rec
+    return [records[k] for k in sorted(records)]
+
+
+def iter_shard(shard, records=None):
+    """
+    Yield (record, image_bytes) in file order with one sequential pass over the shard.
+    records: the index entries of this shard (default: read its sidecar index).
+    """
+    if records is None:
+        records = read_shard_index(shard)
+    with open(shard, "rb", buffering=8 * 1024 * 1024) as f:
+        for rec in sorted(records, key=lambda r: r["offset"]):
+            f.seek(rec["offset"])
+            yield rec, f.read(rec["size"])
+
+
+class ShardReader:
+    """Random access to shard samples; file handles are opened lazily and per process (DataLoader workers)"""
+
+    def __init__(self):
+        self._pid = None
+        self._files = {}
+
+    def read(self, shard, offset, size):
+        if self._pid != os.getpid():
+            # Handles inherited through fork share their file position - reopen in the child
+            self._pid = os.getpid()
+            self._files = {}
+        f = self._files.get(shard)
+        if f is None:
+            f = self._files[shard] = open(shard, "rb")
+        f.seek(int(offset))
+        return f.read(int(size))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __getstate__(self):
+        return {"_pid": None, "_files": {}}
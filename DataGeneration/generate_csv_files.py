@@ -1,61 +1,91 @@
 import os
+import re
 import pandas as pd
 import glob
+from concurrent.futures import ProcessPoolExecutor
 
-source_root = r"./synthetic_dataset" 
+source_root = r"./synthetic_dataset"
+NUM_PROCESSES = os.cpu_count() or 1
+FORCE = False  # regenerate even if gt.csv is newer than game.csv and the images dir
 
-def generate_gt_csv_in_place():
-    game_folders = glob.glob(os.path.join(source_root, "game_*"))
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+LAST_NUMBER = re.compile(r"(\d+)\D*$")
+
+def index_frames(images_dir):
+    """One directory listing -> {frame number: file name}, matched on the file's last number"""
+    frames = {}
+    with os.scandir(images_dir) as it:
+        names = sorted(e.name for e in it if e.is_file() and e.name.lower().endswith(IMAGE_EXTS))
+    for name in names:
+        m = LAST_NUMBER.search(os.path.splitext(name)[0])
+        if m:
+            frames.setdefault(int(m.group(1)), name)
+    return frames
+
+def clean_fens(raw):
+    """Drop a leading "<number> " some CSVs carry before the FEN"""
+    raw = raw.astype(str).str.strip()
+    parts = raw.str.split(' ', n=1, expand=True)
+    if parts.shape[1] < 2:
+        return raw
+    has_prefix = parts[0].str.isdigit() & parts[1].notna()
+    return parts[1].where(has_prefix, raw)
+
+def is_up_to_date(new_csv_path, old_csv_path, images_dir):
+    if not os.path.exists(new_csv_path):
+        return False
+    gt_mtime = os.path.getmtime(new_csv_path)
+    return gt_mtime > os.path.getmtime(old_csv_path) and gt_mtime > os.path.getmtime(images_dir)
+
+def generate_gt_csv_for_game(game_folder, force=False):
+    game_name = os.path.basename(game_folder)
+    old_csv_path = os.path.join(game_folder, "game.csv")
+    images_dir = os.path.join(game_folder, "images")
+    new_csv_path = os.path.join(game_folder, "gt.csv")
+    if not os.path.exists(old_csv_path):
+        return f"Skipping {game_name}: game.csv not found."
+    if not os.path.exists(images_dir):
+        return f"Skipping {game_name}: images folder not found."
+    if not force and is_up_to_date(new_csv_path, old_csv_path, images_dir):
+        return None
+    try:
+        df = pd.read_csv(old_csv_path)
+    except Exception as e:
+        return f"Error reading CSV for {game_name}: {e}"
+
+    viewpoint = "white"
+    if "black" in game_name.lower():
+        viewpoint = "black"
+    frames = index_frames(images_dir)
+    frame_numbers = pd.to_numeric(df.iloc[:, 0], errors="coerce")
+    new_df = pd.DataFrame({
+        "image_name": frame_numbers.map(lambda f: frames.get(int(f)) if pd.notna(f) else None),
+        "fen": clean_fens(df.iloc[:, -1]),
+        "viewpoint": viewpoint,
+    }).dropna(subset=["image_name"])
+
+    if new_df.empty:
+        return f"No valid rows generated for {game_name}"
+    tmp_path = new_csv_path + ".tmp"
+    new_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, new_csv_path)
+    return f"Generated gt.csv for {game_name} ({len(new_df)} rows)"
+
+def generate_gt_csv_in_place(num_processes=NUM_PROCESSES, force=FORCE):
+    # game_XXXX.partial folders are still being rendered
+    game_folders = sorted(p for p in glob.glob(os.path.join(source_root, "game_*")) if not p.endswith(".partial"))
     print(f"Found {len(game_folders)} games. Generating gt.csv files...")
-    for game_folder in game_folders:
-        game_name = os.path.basename(game_folder)
-        old_csv_path = os.path.join(game_folder, "game.csv")
-        images_dir = os.path.join(game_folder, "images")
-        new_csv_path = os.path.join(game_folder, "gt.csv")
-        if not os.path.exists(old_csv_path):
-            print(f"Skipping {game_name}: game.csv not found.")
-            continue          
-        if not os.path.exists(images_dir):
-            print(f"Skipping {game_name}: images folder not found.")
-            continue
-        try:
-            df = pd.read_csv(old_csv_path)
-        except Exception as e:
-            print(f"Error reading CSV for {game_name}: {e}")
-            continue
-        new_rows = []
-        viewpoint = "white"
-        if "black" in game_name.lower():
-            viewpoint = "black"
-        for index, row in df.iterrows():
-            try:
-                frame_number = int(row.iloc[0])
-                raw_fen = str(row.iloc[-1])
-                fen_parts = raw_fen.strip().split(' ', 1)
-                if len(fen_parts) > 1 and fen_parts[0].isdigit():
-                     clean_fen = fen_parts[1]
-                else:
-                    clean_fen = raw_fen
-                pattern = os.path.join(images_dir, f"*{frame_number}.*") 
-                matches = glob.glob(pattern)
-                image_matches = [m for m in matches if m.lower().endswith(('.png', '.jpg', '.jpeg'))]
-                if image_matches:
-                    full_path = image_matches[0]
-                    actual_filename = os.path.basename(full_path)  
-                    new_rows.append({
-                        "image_name": actual_filename, 
-                        "fen": clean_fen,
-                        "viewpoint": viewpoint
-                    })
-            except Exception as e:
-                pass
-        if new_rows:
-            new_df = pd.DataFrame(new_rows)
-            new_df = new_df[["image_name", "fen", "viewpoint"]]            
-            new_df.to_csv(new_csv_path, index=False)
-            print(f"Generated gt.csv for {game_name} ({len(new_df)} rows)")
-        else:
-            print(f"No valid rows generated for {game_name}")
+    with ProcessPoolExecutor(max_workers=max(1, num_processes)) as pool:
+        results = pool.map(generate_gt_csv_for_game, game_folders, [force] * len(game_folders),
+                           chunksize=max(1, len(game_folders) // (4 * max(1, num_processes))))
+        up_to_date = 0
+        for msg in results:
+            if msg is None:
+                up_to_date += 1
+            else:
+                print(msg)
+    if up_to_date:
+        print(f"{up_to_date} games already up to date.")
     print("Done.")
 if __name__ == "__main__":
-    generate_gt_csv_in_place()
\ No newline at end of file
+    generate_gt_csv_in_place()
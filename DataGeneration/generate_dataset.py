@@ -1,16 +1,8 @@
-import os, shutil, subprocess, csv, random, time
+import os, random
 import chess
-import re, glob
-
-def next_game_index(out_root):
-    os.makedirs(out_root, exist_ok=True)
-    existing = glob.glob(os.path.join(out_root, "game_*"))
-    ids = []
-    for p in existing:
-        m = re.search(r"game_(\d{4})$", os.path.basename(p))
-        if m:
-            ids.append(int(m.group(1)))
-    return (max(ids) + 1) if ids else 0
+from render_worker import BlenderRenderWorker
+from render_farm import JobLedger, next_game_index, run_farm
+from render_cache import RenderCache
 
 BLENDER = r"C:\Program Files\Blender Foundation\Blender 5.0\blender.exe"
 BLEND_FILE = "chess-set.blend"
@@ -30,53 +22,31 @@ VIEW_OPTIONS = ["white", "black"]
 
 ENFORCE_GLOBAL_VIEW_BALANCE = True
 
+# Parallel Blender workers; each run stages under its own run_* dir in STAGING_RENDERS_DIR (removed at the end)
+NUM_WORKERS = 4
+THREADS_PER_WORKER = max(1, (os.cpu_count() or NUM_WORKERS) // NUM_WORKERS)
+# Render each game as one keyframed animation pass per camera instead of one render call per image
+RENDER_AS_ANIMATION = True
+# Frames keyed by (position, view, camera, resolution, samples, .blend hash) are reused instead of re-rendered.
+# Shared by both generators; keep it on the same drive as OUT_ROOT so frames are hard-linked, not copied.
+RENDER_CACHE_DIR = r"C:\render_cache"
+RENDER_CACHE_MAX_GB = 20
+# Set to a folder to write tar shards (dataset_shards.py) instead of game_XXXX/images + game.csv;
+# the training notebook reads them with SHARD_ROOTS, no gt.csv pass needed
+SHARD_OUTPUT_DIR = None
+
 rng = random.Random(SEED) if SEED is not None else random.Random()
 
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
-def clean_staging():
-    ensure_dir(STAGING_RENDERS_DIR)
-    for f in os.listdir(STAGING_RENDERS_DIR):
-        p = os.path.join(STAGING_RENDERS_DIR, f)
-        if os.path.isfile(p) and f.lower().endswith((".png", ".jpg", ".jpeg")):
-            os.remove(p)
-
-def run_blender_render(fen: str, view: str):
-    cmd = [
-        BLENDER,
-        BLEND_FILE,
-        "--background",
-        "--python", BLENDER_SCRIPT,
-        "--",
-        "--fen", fen,
-        "--view", view,
-        "--resolution", str(RESOLUTION),
-        "--samples", str(SAMPLES),
-    ]
-    subprocess.run(cmd, check=True)
+def run_seed() -> int:
+    """SEED, or a fresh seed per run when SEED is None (recorded in the ledger with the planned games)"""
+    return SEED if SEED is not None else random.randrange(2**63)
 
-def wait_for_outputs(timeout_sec=120):
-    t0 = time.time()
-    while time.time() - t0 < timeout_sec:
-        present = set(os.listdir(STAGING_RENDERS_DIR))
-        if "1_overhead.png" in present:
-            p2 = [f for f in present if f.startswith("2_") and f.lower().endswith(".png")]
-            p3 = [f for f in present if f.startswith("3_") and f.lower().endswith(".png")]
-            if p2 and p3:
-                p2 = sorted(p2)[0]
-                p3 = sorted(p3)[0]
-                return [
-                    os.path.join(STAGING_RENDERS_DIR, "1_overhead.png"),
-                    os.path.join(STAGING_RENDERS_DIR, p2),
-                    os.path.join(STAGING_RENDERS_DIR, p3),
-                ]
-        time.sleep(0.25)
-
-    raise RuntimeError(
-        f"Timeout waiting for renders in {STAGING_RENDERS_DIR}. "
-        f"Found: {os.listdir(STAGING_RENDERS_DIR)[:20]}"
-    )
+def game_rng(seed: int, g: int) -> random.Random:
+    """Per-game RNG: a game's moves do not depend on worker count or on other games"""
+    return random.Random(f"{seed}:{g}")
 
 def choose_view(game_idx: int, remaining_white: int, remaining_black: int) -> str:
     """
@@ -91,61 +61,60 @@ def choose_view(game_idx: int, remaining_white: int, remaining_black: int) -> st
         return "white"
     return rng.choice(VIEW_OPTIONS)
 
-def main():
-    ensure_dir(OUT_ROOT)
-    start_g = next_game_index(OUT_ROOT)
+def plan_game(seed: int, g: int, view: str) -> dict:
+    """Play the random game up front; the render farm only renders the planned FENs"""
+    grng = game_rng(seed, g)
+    plies_per_game = grng.choice(PLIES_OPTIONS)
+    views_per_fen = grng.choice(VIEWS_PER_FEN_OPTIONS)
+    board = chess.Board()
+    plies = []
+    for ply in range(plies_per_game):
+        fen_board = board.fen().split()[0]
+        views = [0, 1, 2] if views_per_fen == 3 else grng.sample([0, 1, 2], k=2)
+        plies.append({"fen": fen_board, "views": views})
+        if board.is_game_over():
+            board.reset()
+        legal = list(board.legal_moves)
+        board.push(grng.choice(legal))
+    return {"game": f"game_{g:04d}", "view": view, "plies": plies}
+
+def plan_games(seed: int, start_g: int) -> list:
     remaining_white = NUM_GAMES // 2
     remaining_black = NUM_GAMES - remaining_white
+    specs = []
     for gi, g in enumerate(range(start_g, start_g + NUM_GAMES)):
-        game_dir = os.path.join(OUT_ROOT, f"game_{g:04d}")
-        if os.path.exists(game_dir):
-            print(f"[SKIP] {game_dir} already exists")
-            continue
-        images_dir = os.path.join(game_dir, "images")
-        ensure_dir(images_dir)
         view = choose_view(gi, remaining_white, remaining_black)
         if ENFORCE_GLOBAL_VIEW_BALANCE:
             if view == "white":
                 remaining_white -= 1
             else:
                 remaining_black -= 1
-        plies_per_game = rng.choice(PLIES_OPTIONS)
-        views_per_fen = rng.choice(VIEWS_PER_FEN_OPTIONS)
+        specs.append(plan_game(seed, g, view))
         print(
-            f"[Game {g:04d}] view={view}, plies={plies_per_game}, views_per_fen={views_per_fen}, "
+            f"[Game {g:04d}] view={view}, plies={len(specs[-1]['plies'])}, "
             f"res={RESOLUTION}, samples={SAMPLES}"
         )
+    return specs
 
-        board = chess.Board()
-        rows = []
-        frame_idx = 0
-
-        for ply in range(plies_per_game):
-            fen_board = board.fen().split()[0]
-            if CLEAN_STAGING_EACH_TIME:
-                clean_staging()
-            run_blender_render(fen_board, view=view)
-            render_paths = wait_for_outputs()
-            selected = render_paths if views_per_fen == 3 else rng.sample(render_paths, k=2)
-            for rp in selected:
-                dst = os.path.join(images_dir, f"frame_{frame_idx:06d}.png")
-                shutil.move(rp, dst)
-                rows.append((frame_idx, frame_idx, fen_board))
-                frame_idx += 1
-            if views_per_fen == 2:
-                for rp in render_paths:
-                    if os.path.exists(rp):
-                        os.remove(rp)
-            if board.is_game_over():
-                board.reset()
-            legal = list(board.legal_moves)
-            board.push(rng.choice(legal))
-        csv_path = os.path.join(game_dir, "game.csv")
-        with open(csv_path, "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            w.writerow(["from_frame", "to_frame", "fen"])
-            w.writerows(rows)
-        print(f"[OK] {game_dir} frames={frame_idx}")
+def main():
+    ensure_dir(OUT_ROOT)
+    ledger = JobLedger(OUT_ROOT)
+    if ledger.pending():
+        print(f"Resuming {len(ledger.pending())} pending games from {ledger.path}")
+    else:
+        seed = run_seed()
+        ledger.add(plan_games(seed, next_game_index(OUT_ROOT, ledger, SHARD_OUTPUT_DIR)), seed=seed)
+    run_farm(
+        ledger, OUT_ROOT,
+        make_worker=lambda: BlenderRenderWorker(BLENDER, BLEND_FILE, BLENDER_SCRIPT, RESOLUTION, SAMPLES,
+                                                threads=THREADS_PER_WORKER, echo=(NUM_WORKERS == 1)),
+        num_workers=NUM_WORKERS,
+        staging_root=STAGING_RENDERS_DIR,
+        clean_staging=CLEAN_STAGING_EACH_TIME,
+        animate=RENDER_AS_ANIMATION,
+        cache=RenderCache(RENDER_CACHE_DIR, BLEND_FILE, RESOLUTION, SAMPLES, max_bytes=RENDER_CACHE_MAX_GB * 1024**3),
+        shard_dir=SHARD_OUTPUT_DIR,
+    )
     print("\nDONE.")
     print(f"Dataset root: {os.path.abspath(OUT_ROOT)}")
 if __name__ == "__main__":
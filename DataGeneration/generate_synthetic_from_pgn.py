@@ -1,4 +1,7 @@
-import os, shutil, subprocess, csv, random, time, glob, re
+import os, random
+from render_worker import BlenderRenderWorker
+from render_farm import JobLedger, next_game_index, run_farm
+from render_cache import RenderCache
 
 
 BLENDER = r"C:\Program Files\Blender Foundation\Blender 5.0\blender.exe"
@@ -17,57 +20,31 @@ SEED = 42
 CLEAN_STAGING_EACH_TIME = True
 ENFORCE_GLOBAL_VIEW_BALANCE = True
 
-rng = random.Random(SEED)
+# Parallel Blender workers; each run stages under its own run_* dir in STAGING_RENDERS_DIR (removed at the end)
+NUM_WORKERS = 4
+THREADS_PER_WORKER = max(1, (os.cpu_count() or NUM_WORKERS) // NUM_WORKERS)
+# Render each game as one keyframed animation pass per camera instead of one render call per image
+RENDER_AS_ANIMATION = True
+# Frames keyed by (position, view, camera, resolution, samples, .blend hash) are reused instead of re-rendered.
+# Shared by both generators; keep it on the same drive as OUT_ROOT so frames are hard-linked, not copied.
+RENDER_CACHE_DIR = r"C:\render_cache"
+RENDER_CACHE_MAX_GB = 20
+# Set to a folder to write tar shards (dataset_shards.py) instead of game_XXXX/images + game.csv;
+# the training notebook reads them with SHARD_ROOTS, no gt.csv pass needed
+SHARD_OUTPUT_DIR = None
+
+rng = random.Random(SEED) if SEED is not None else random.Random()
 
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
-def next_game_index(out_root):
-    ensure_dir(out_root)
-    existing = glob.glob(os.path.join(out_root, "game_*"))
-    ids = []
-    for p in existing:
-        m = re.search(r"game_(\d{4})$", os.path.basename(p))
-        if m:
-            ids.append(int(m.group(1)))
-    return (max(ids) + 1) if ids else 0
-
-def clean_staging():
-    ensure_dir(STAGING_RENDERS_DIR)
-    for f in os.listdir(STAGING_RENDERS_DIR):
-        p = os.path.join(STAGING_RENDERS_DIR, f)
-        if os.path.isfile(p) and f.lower().endswith(".png"):
-            os.remove(p)
-
-def run_blender_render(fen: str, view: str):
-    cmd = [
-        BLENDER,
-        BLEND_FILE,
-        "--background",
-        "--python", BLENDER_SCRIPT,
-        "--",
-        "--fen", fen,
-        "--view", view,
-        "--resolution", str(RESOLUTION),
-        "--samples", str(SAMPLES),
-    ]
-    subprocess.run(cmd, check=True)
-
-def wait_for_outputs(timeout_sec=120):
-    t0 = time.time()
-    while time.time() - t0 < timeout_sec:
-        files = os.listdir(STAGING_RENDERS_DIR)
-        if "1_overhead.png" in files:
-            p2 = sorted([f for f in files if f.startswith("2_")])
-            p3 = sorted([f for f in files if f.startswith("3_")])
-            if p2 and p3:
-                return [
-                    os.path.join(STAGING_RENDERS_DIR, "1_overhead.png"),
-                    os.path.join(STAGING_RENDERS_DIR, p2[0]),
-                    os.path.join(STAGING_RENDERS_DIR, p3[0]),
-                ]
-        time.sleep(0.25)
-    raise RuntimeError("Timeout waiting for Blender renders")
+def run_seed() -> int:
+    """SEED, or a fresh seed per run when SEED is None (recorded in the ledger with the planned games)"""
+    return SEED if SEED is not None else random.randrange(2**63)
+
+def game_rng(seed: int, g: int) -> random.Random:
+    """Per-game RNG: a game's view selection does not depend on worker count"""
+    return random.Random(f"{seed}:{g}")
 
 def choose_view(rem_white, rem_black):
     if not ENFORCE_GLOBAL_VIEW_BALANCE:
@@ -82,62 +59,53 @@ def load_fens(path):
     with open(path, "r", encoding="utf-8") as f:
         return [l.strip().split()[0] for l in f if l.strip()]
 
-def main():
-    ensure_dir(OUT_ROOT)
-    fens = load_fens(FENS_FILE)
-    print("Loaded FENs:", len(fens))
-
+def plan_games(fens, seed, start_g):
     rem_white = NUM_GAMES // 2
     rem_black = NUM_GAMES - rem_white
 
     fen_cursor = 0
-    start_g = next_game_index(OUT_ROOT)
-
+    specs = []
     for g in range(start_g, start_g + NUM_GAMES):
-        game_dir = os.path.join(OUT_ROOT, f"game_{g:04d}")
-        images_dir = os.path.join(game_dir, "images")
-        ensure_dir(images_dir)
-
         view = choose_view(rem_white, rem_black)
         if ENFORCE_GLOBAL_VIEW_BALANCE:
             if view == "white": rem_white -= 1
             else: rem_black -= 1
 
-        views_per_fen = rng.choice(VIEWS_PER_FEN_OPTIONS)
-        rows = []
-        frame_idx = 0
-
-        print(f"[Game {g:04d}] view={view}, positions={POSITIONS_PER_GAME}")
-
+        grng = game_rng(seed, g)
+        views_per_fen = grng.choice(VIEWS_PER_FEN_OPTIONS)
+        plies = []
         for _ in range(POSITIONS_PER_GAME):
             fen = fens[fen_cursor % len(fens)]
             fen_cursor += 1
+            views = [0, 1, 2] if views_per_fen == 3 else grng.sample([0, 1, 2], k=2)
+            plies.append({"fen": fen, "views": views})
 
-            if CLEAN_STAGING_EACH_TIME:
-                clean_staging()
-
-            run_blender_render(fen, view=view)
-            render_paths = wait_for_outputs()
-
-            selected = render_paths if views_per_fen == 3 else rng.sample(render_paths, k=2)
-
-            for rp in selected:
-                dst = os.path.join(images_dir, f"frame_{frame_idx:06d}.png")
-                shutil.move(rp, dst)
-                rows.append((frame_idx, frame_idx, fen))
-                frame_idx += 1
-
-            if views_per_fen == 2:
-                for rp in render_paths:
-                    if os.path.exists(rp):
-                        os.remove(rp)
-
-        with open(os.path.join(game_dir, "game.csv"), "w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f)
-            w.writerow(["from_frame", "to_frame", "fen"])
-            w.writerows(rows)
+        print(f"[Game {g:04d}] view={view}, positions={POSITIONS_PER_GAME}")
+        specs.append({"game": f"game_{g:04d}", "view": view, "plies": plies})
+    return specs
 
-        print(f"[OK] {game_dir} frames={frame_idx}")
+def main():
+    ensure_dir(OUT_ROOT)
+    ledger = JobLedger(OUT_ROOT)
+    if ledger.pending():
+        print(f"Resuming {len(ledger.pending())} pending games from {ledger.path}")
+    else:
+        fens = load_fens(FENS_FILE)
+        print("Loaded FENs:", len(fens))
+        seed = run_seed()
+        ledger.add(plan_games(fens, seed, next_game_index(OUT_ROOT, ledger, SHARD_OUTPUT_DIR)), seed=seed)
+
+    run_farm(
+        ledger, OUT_ROOT,
+        make_worker=lambda: BlenderRenderWorker(BLENDER, BLEND_FILE, BLENDER_SCRIPT, RESOLUTION, SAMPLES,
+                                                threads=THREADS_PER_WORKER, echo=(NUM_WORKERS == 1)),
+        num_workers=NUM_WORKERS,
+        staging_root=STAGING_RENDERS_DIR,
+        clean_staging=CLEAN_STAGING_EACH_TIME,
+        animate=RENDER_AS_ANIMATION,
+        cache=RenderCache(RENDER_CACHE_DIR, BLEND_FILE, RESOLUTION, SAMPLES, max_bytes=RENDER_CACHE_MAX_GB * 1024**3),
+        shard_dir=SHARD_OUTPUT_DIR,
+    )
 
     print("DONE:", os.path.abspath(OUT_ROOT))
 
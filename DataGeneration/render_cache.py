@@ -0,0 +1,178 @@
+"""
+Content-addressed cache of rendered frames.
+
+Many renders repeat: every random game starts from the initial position (and
+again after board.reset()), common openings recur, and the PGN generator cycles
+through its FEN list. A frame is fully determined by
+
+    (board FEN, view, camera name, resolution, samples, blend-file hash)
+
+so its PNG is stored once under the hash of that key and later frames are
+hard-linked (or copied, across drives) instead of being rendered again.
+The cache is bounded by max_bytes and evicts the least recently used frames.
+
+Several generator processes may share one cache directory: a frame another
+process added is picked up on lookup, temporary files are unique per process and
+thread, and the directory is re-scanned (sizes and mtimes = last use of every
+process) every RESCAN_EVERY puts and before evicting, so the processes enforce
+max_bytes on the shared total rather than each on its own view.
+
+Usage:
+    cache = RenderCache(RENDER_CACHE_DIR, BLEND_FILE, RESOLUTION, SAMPLES, max_bytes=20 * 1024**3)
+    if not cache.get(fen, "white", 1, dst):
+        ...render...
+        cache.put(fen, "white", 1, rendered_png)
+    print(cache.summary())
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# Must match camera_views() in chess_position_api_v2.py (index = position in the rendered list)
+CAMERA_NAMES = {
+    "white": ["1_overhead", "2_east", "3_west"],
+    "black": ["1_overhead", "2_west", "3_east"],
+}
+RESCAN_EVERY = 256
+# Eviction goes down to this fraction of max_bytes, so it (and its re-scan) runs once per many puts
+EVICT_TO = 0.9
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst (same volume), otherwise copy it"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class RenderCache:
+    def __init__(self, root, blend_file, resolution, samples, max_bytes=20 * 1024**3):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.settings = f"{int(resolution)}|{int(samples)}|{file_hash(blend_file)}"
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.puts_since_scan = 0
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """
+        key -> size, least recently used first. Last use is the file mtime (get() touches it), so the
+        order survives restarts and covers the other processes sharing the directory.
+        """
+        found = []
+        for sub in os.listdir(self.root):
+            sub_dir = os.path.join(self.root, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for entry in os.scandir(sub_dir):
+                if entry.name.endswith(".png"):
+                    try:
+                        st = entry.stat()
+                    except OSError:  # evicted by another process meanwhile
+                        continue
+                    found.append((st.st_mtime, entry.name[:-4], st.st_size))
+        found.sort()
+        self.entries = OrderedDict((key, size) for _, key, size in found)
+        self.total_bytes = sum(self.entries.values())
+        self.puts_since_scan = 0
+
+    def key(self, fen, view, view_index):
+        board_fen = fen.split()[0]
+        camera = CAMERA_NAMES[view][view_index]
+        return hashlib.sha1(f"{board_fen}|{view}|{camera}|{self.settings}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + ".png")
+
+    def get(self, fen, view, view_index, dst):
+        """Materialize a cached frame at dst. Returns False on a miss"""
+        key = self.key(fen, view, view_index)
+        path = self._path(key)
+        with self.lock:
+            if key not in self.entries:
+                if not os.path.exists(path):
+                    self.misses += 1
+                    return False
+                self._adopt(key)  # put by another process sharing the cache
+            now = time.time()
+            try:
+                link_or_copy(path, dst)
+                os.utime(path, (now, now))
+            except OSError:
+                # Removed behind our back (evicted by another process, cache dir cleaned by hand)
+                self._drop(key)
+                self.misses += 1
+                return False
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def put(self, fen, view, view_index, src):
+        """Add a freshly rendered frame; beyond max_bytes, evicts least recently used frames down to EVICT_TO of it"""
+        key = self.key(fen, view, view_index)
+        path = self._path(key)
+        with self.lock:
+            if key in self.entries:
+                return
+            if os.path.exists(path):
+                self._adopt(key)
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unique per process and thread: concurrent puts of one key never share a tmp file
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            link_or_copy(src, tmp)
+            os.replace(tmp, path)
+            self.entries[key] = os.path.getsize(path)
+            self.total_bytes += self.entries[key]
+            self.puts_since_scan += 1
+            if self.puts_since_scan >= RESCAN_EVERY:
+                self._scan()
+            self._evict()
+
+    def _adopt(self, key):
+        try:
+            size = os.path.getsize(self._path(key))
+        except OSError:
+            return
+        self.entries[key] = size
+        self.total_bytes += size
+
+    def _drop(self, key):
+        self.total_bytes -= self.entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # The other processes' frames count against the same budget
+        self._scan()
+        while self.total_bytes > EVICT_TO * self.max_bytes and self.entries:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return (f"Render cache: {self.hits} hits / {self.misses} misses ({rate:.1f}% hit rate), "
+                f"{len(self.entries)} frames, {self.total_bytes / 1024**2:.1f} MB, {self.evictions} evicted")
@@ -0,0 +1,247 @@
+"""
+Parallel render farm for the dataset generators.
+
+The generators plan every game up front (view, plies and FEN sequence, seeded
+per game) and hand the plans to run_farm(), which spreads the games over N
+render workers. Each worker is its own Blender process (render_worker.py) with
+its own staging dir inside a per-run directory under the staging root (created
+with tempfile.mkdtemp, removed when the run ends), so several runs and workers can
+share a machine and one staging root.
+
+The plans live in a JSON ledger in the output root. A game is rendered into
+game_XXXX.partial and only renamed to game_XXXX after its game.csv is written,
+then marked done in the ledger - a killed run leaves no half-written game
+folders and re-running the generator resumes with the pending games.
+
+Game spec (JSON-serializable, produced by the generators):
+    {"game": "game_0007", "view": "white",
+     "plies": [{"fen": "<board fen>", "views": [0, 1, 2]}, ...]}
+"views" are indices into the rendered [1_overhead, 2_*, 3_*] files to keep.
+
+With shard_dir set, finished games are appended to per-worker tar shards
+(dataset_shards.py) instead of being published as folders.
+
+With a RenderCache (render_cache.py) only frames that are not cached yet are
+rendered; the rest are hard-linked from the cache.
+"""
+import csv
+import glob
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from dataset_shards import ShardWriter, load_shard_index
+from render_cache import CAMERA_NAMES, link_or_copy
+
+LEDGER_NAME = "render_ledger.json"
+GAME_NAME = re.compile(r"game_(\d{4,})$")
+
+
+def clean_staging_dir(staging_dir):
+    os.makedirs(staging_dir, exist_ok=True)
+    for f in os.listdir(staging_dir):
+        p = os.path.join(staging_dir, f)
+        if os.path.isfile(p) and f.lower().endswith((".png", ".jpg", ".jpeg")):
+            os.remove(p)
+
+
+class JobLedger:
+    """
+    Persistent {game: {"spec": ..., "status": "pending"|"done", "seed": ...}} table, saved after every
+    change. "seed" is the run seed the game was planned from (a drawn one when the generator is unseeded).
+    """
+
+    def __init__(self, out_root):
+        os.makedirs(out_root, exist_ok=True)
+        self.path = os.path.join(out_root, LEDGER_NAME)
+        self.lock = threading.Lock()
+        self.games = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.games = json.load(f)["games"]
+
+    def pending(self):
+        with self.lock:
+            return [g["spec"] for g in self.games.values() if g["status"] != "done"]
+
+    def add(self, specs, seed=None):
+        """Adds new game plans; a game id that is already in the ledger (done or pending) is an error"""
+        with self.lock:
+            taken = sorted(spec["game"] for spec in specs if spec["game"] in self.games)
+            if taken:
+                raise ValueError(f"{len(taken)} games are already in {self.path} (e.g. {taken[0]}); "
+                                 "plan new games from next_game_index()")
+            for spec in specs:
+                self.games[spec["game"]] = {"spec": spec, "status": "pending", "seed": seed}
+            self._save()
+
+    def mark_done(self, game, frames):
+        with self.lock:
+            self.games[game]["status"] = "done"
+            self.games[game]["frames"] = int(frames)
+            self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"games": self.games}, f)
+        os.replace(tmp, self.path)
+
+
+def next_game_index(out_root, ledger=None, shard_dir=None):
+    """
+    First game number after every game_XXXX folder in out_root, every game in the ledger and
+    every game in the shard indexes of shard_dir - with shards there are no game folders, so the
+    folders alone would restart the numbering at 0 and the new shards would shadow the old games.
+    """
+    os.makedirs(out_root, exist_ok=True)
+    names = [os.path.basename(p) for p in glob.glob(os.path.join(out_root, "game_*"))]
+    if ledger is not None:
+        names += list(ledger.games)
+    if shard_dir and os.path.isdir(shard_dir):
+        names += [rec.get("game", "") for rec in load_shard_index(shard_dir)]
+    ids = [int(m.group(1)) for m in map(GAME_NAME.match, names) if m]
+    return (max(ids) + 1) if ids else 0
+
+
+def render_game(worker, spec, out_root, staging_dir, clean_staging=True, animate=False, cache=None,
+                shard_writer=None):
+    """
+    Render one planned game into game_XXXX.partial, then publish it as game_XXXX
+    (or, with a shard_writer, append its frames to the worker's shard and drop the folder).
+    Frames found in the render cache (and repeated positions within the game) are not rendered again.
+    """
+    game_dir = os.path.join(out_root, spec["game"])
+    partial_dir = game_dir + ".partial"
+    if os.path.exists(partial_dir):
+        shutil.rmtree(partial_dir)
+    images_dir = os.path.join(partial_dir, "images")
+    os.makedirs(images_dir)
+
+    view = spec["view"]
+    rows = []
+    view_names = []
+    missing = []
+    for ply in spec["plies"]:
+        for vi in ply["views"]:
+            frame_idx = len(rows)
+            dst = os.path.join(images_dir, f"frame_{frame_idx:06d}.png")
+            rows.append((frame_idx, frame_idx, ply["fen"]))
+            view_names.append(CAMERA_NAMES[view][vi])
+            if cache is None or not cache.get(ply["fen"], view, vi, dst):
+                missing.append((ply["fen"], vi, dst))
+
+    if missing:
+        if clean_staging:
+            clean_staging_dir(staging_dir)
+        # All missing positions are one job: the worker moves only the changed pieces between them
+        # (animate: one keyframed animation render per camera instead of one render call per image)
+        fens = list(dict.fromkeys(fen for fen, _, _ in missing))
+        rendered = dict(zip(fens, worker.render_sequence(fens, view=view, out_dir=staging_dir, animate=animate)))
+        for fen, vi, dst in missing:
+            link_or_copy(rendered[fen][vi], dst)
+            if cache is not None:
+                cache.put(fen, view, vi, rendered[fen][vi])
+        for render_paths in rendered.values():
+            for rp in render_paths:
+                if os.path.exists(rp):
+                    os.remove(rp)
+
+    if shard_writer is not None:
+        samples = []
+        for (frame_idx, _, fen), view_name in zip(rows, view_names):
+            with open(os.path.join(images_dir, f"frame_{frame_idx:06d}.png"), "rb") as f:
+                data = f.read()
+            meta = {"fen": fen, "viewpoint": view, "view": view_name, "game": spec["game"],
+                    "frame": frame_idx, "domain": "synthetic"}
+            samples.append((f"{spec['game']}_{frame_idx:06d}", data, meta))
+        shard_writer.write_game(samples)
+        shutil.rmtree(partial_dir)
+        return len(rows)
+
+    with open(os.path.join(partial_dir, "game.csv"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["from_frame", "to_frame", "fen"])
+        w.writerows(rows)
+    os.replace(partial_dir, game_dir)
+    return len(rows)
+
+
+def run_farm(ledger, out_root, make_worker, num_workers, staging_root, clean_staging=True, animate=False,
+             cache=None, shard_dir=None):
+    """
+    Render all pending games of the ledger with num_workers parallel render workers.
+    make_worker(): returns a new (not yet started) BlenderRenderWorker.
+    animate: render each game as a Blender animation (see BlenderRenderWorker.render_sequence).
+    cache: optional RenderCache shared by all workers.
+    shard_dir: write the games into tar shards there (one writer per worker, see dataset_shards.py)
+               instead of game_XXXX folders.
+    staging_root: the run stages its renders in a fresh run_* directory there, so concurrent
+                  runs never clean each other's staging dirs; it is removed when the run ends.
+    Failed games stay pending in the ledger and are retried on the next run.
+    """
+    jobs = queue.Queue()
+    for spec in ledger.pending():
+        game_dir = os.path.join(out_root, spec["game"])
+        if os.path.exists(game_dir):
+            print(f"[SKIP] {game_dir} already exists")
+            ledger.mark_done(spec["game"], frames=-1)
+            continue
+        jobs.put(spec)
+
+    total = jobs.qsize()
+    num_workers = max(1, min(int(num_workers), total))
+    print(f"Render farm: {total} games on {num_workers} workers")
+    failed = []
+    t0 = time.time()
+    os.makedirs(staging_root, exist_ok=True)
+    run_staging = tempfile.mkdtemp(prefix="run_", dir=staging_root)
+
+    def work(wi):
+        staging_dir = os.path.join(run_staging, f"worker_{wi:02d}")
+        shard_writer = ShardWriter(shard_dir, prefix=f"w{wi:02d}") if shard_dir else None
+        # Shard and index files are closed however the thread ends, also when a worker fails to (re)start
+        try:
+            with make_worker() as worker:
+                while True:
+                    try:
+                        spec = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    print(f"[W{wi:02d}] [{spec['game']}] view={spec['view']}, positions={len(spec['plies'])}")
+                    try:
+                        frames = render_game(worker, spec, out_root, staging_dir, clean_staging=clean_staging,
+                                             animate=animate, cache=cache, shard_writer=shard_writer)
+                    except Exception as e:
+                        print(f"[W{wi:02d}] [FAIL] {spec['game']}: {e}")
+                        failed.append(spec["game"])
+                        if not worker.alive():
+                            worker.close()
+                            worker.start()
+                        continue
+                    ledger.mark_done(spec["game"], frames)
+                    print(f"[W{wi:02d}] [OK] {spec['game']} frames={frames}")
+        finally:
+            if shard_writer is not None:
+                shard_writer.close()
+
+    threads = [threading.Thread(target=work, args=(wi,), daemon=True) for wi in range(num_workers)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        shutil.rmtree(run_staging, ignore_errors=True)
+
+    print(f"Render farm done in {time.time() - t0:.1f}s: {total - len(failed)} games, {len(failed)} failed")
+    if cache is not None:
+        print(cache.summary())
+    if failed:
+        print("Failed (still pending, re-run to retry):", sorted(failed))
+    return failed
@@ -0,0 +1,115 @@
+"""
+Client for the render worker mode of chess_position_api_v2.py (--serve).
+
+One Blender process loads chess-set.blend, fixes the board and detects the
+starting pieces once; every FEN after that only pays for the Cycles render.
+Jobs go to Blender's stdin as JSON lines and the finished file paths come back
+on stdout, so there is no polling of the staging dir.
+
+Usage:
+    with BlenderRenderWorker(BLENDER, BLEND_FILE, BLENDER_SCRIPT, RESOLUTION, SAMPLES) as worker:
+        paths = worker.render(fen, view="white", out_dir=STAGING_RENDERS_DIR)
+        per_fen_paths = worker.render_sequence(game_fens, view="white", out_dir=STAGING_RENDERS_DIR)
+        per_fen_paths = worker.render_sequence(game_fens, view="white", out_dir=STAGING_RENDERS_DIR, animate=True)
+"""
+import json
+import os
+import subprocess
+
+# Must match RESULT_PREFIX in chess_position_api_v2.py
+RESULT_PREFIX = "@@RENDER_RESULT "
+
+
+class BlenderRenderWorker:
+    def __init__(self, blender, blend_file, script, resolution, samples, threads=0, echo=True):
+        self.cmd = [
+            blender,
+            blend_file,
+            "--background",
+            # 0 = all cores; set when several workers share one machine
+            "--threads", str(int(threads)),
+            "--python", script,
+            "--",
+            "--serve",
+            "--resolution", str(resolution),
+            "--samples", str(samples),
+        ]
+        self.echo = echo
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+        )
+        msg = self._read_reply()
+        if not msg.get("ready"):
+            raise RuntimeError(f"Render worker failed to start: {msg}")
+        return self
+
+    def _read_reply(self):
+        """Read stdout until the next protocol line; everything else is Blender's log"""
+        for line in self.proc.stdout:
+            pos = line.find(RESULT_PREFIX)
+            if pos >= 0:
+                return json.loads(line[pos + len(RESULT_PREFIX):])
+            if self.echo:
+                print(line, end="")
+        code = self.proc.wait()
+        raise RuntimeError(f"Render worker exited with code {code}")
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def render(self, fen: str, view: str, out_dir: str):
+        """Render the 3 views of one position, returns [1_overhead, 2_*, 3_*] paths"""
+        return self._submit({"fen": fen, "view": view}, out_dir, what=fen)
+
+    def render_sequence(self, fens, view: str, out_dir: str, animate: bool = False):
+        """
+        Render consecutive positions (e.g. a whole game) in one job; the worker only moves
+        the pieces that changed between positions. Returns one [1_overhead, 2_*, 3_*] list per FEN.
+        animate=True keyframes the positions and renders one animation pass per camera
+        (files are then named frame_XXXXXX.png, 3 per FEN).
+        """
+        if not fens:
+            return []
+        job = {"fens": list(fens), "view": view, "animate": bool(animate)}
+        return self._submit(job, out_dir, what=f"{len(fens)} positions")
+
+    def _submit(self, job, out_dir, what):
+        if self.proc is None:
+            self.start()
+        os.makedirs(out_dir, exist_ok=True)
+        job["out_dir"] = os.path.abspath(out_dir)
+        self.proc.stdin.write(json.dumps(job) + "\n")
+        self.proc.stdin.flush()
+        msg = self._read_reply()
+        if not msg.get("ok"):
+            raise RuntimeError(f"Render failed for {what} ({job['view']}): {msg.get('error')}")
+        return msg["paths"]
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.write(json.dumps({"cmd": "quit"}) + "\n")
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.proc = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
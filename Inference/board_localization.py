@@ -0,0 +1,229 @@
+"""
+Board localization for real photos (numpy + OpenCV only, no torch).
+
+Same pipeline as final_model.ipynb: grid-line masks, Hough segments on a
+downscaled copy, deterministic 1-D clustering into 9 horizontal and 9 vertical
+lines, full-resolution refinement of the 81 intersections and a RANSAC
+homography to a square board. BoardTracker reuses the homography across the
+ordered frames of a static-camera game.
+
+Usage:
+    board_bgr, dbg = preprocess_board_real(img_bgr, out_size=512)
+"""
+import math
+
+import cv2
+import numpy as np
+
+# Grid lines are detected on a copy at most this many pixels on a side (None = full resolution)
+LOCALIZE_MAX_SIDE = 1024
+
+
+def normalize_line(rho, theta):
+    if rho < 0:
+        rho = -rho
+        theta = (theta + np.pi) % np.pi
+    return float(rho), float(theta)
+
+
+def extract_grid_masks(gray):
+    g = cv2.GaussianBlur(gray, (5,5), 0)
+    bw = cv2.adaptiveThreshold(g, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                              cv2.THRESH_BINARY_INV, 21, 5)
+    H, W = bw.shape
+    bw2 = cv2.morphologyEx(bw, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (3,3)), iterations=1)
+    h_len = max(25, W // 14); v_len = max(25, H // 14)
+    h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (h_len, 1))
+    v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, v_len))
+    h_mask = cv2.dilate(cv2.erode(bw2, h_kernel, iterations=1), h_kernel, iterations=2)
+    v_mask = cv2.dilate(cv2.erode(bw2, v_kernel, iterations=1), v_kernel, iterations=2)
+    return h_mask, v_mask
+
+
+def hough_mask_lines(mask, is_horizontal):
+    linesP = cv2.HoughLinesP(mask, rho=1, theta=np.pi/180, threshold=50,
+                             minLineLength=40, maxLineGap=30)
+    if linesP is None:
+        return np.zeros((0,2), dtype=np.float32)
+    x1, y1, x2, y2 = linesP.reshape(-1, 4).astype(np.float32).T
+    ang = np.abs(np.degrees(np.arctan2(y2 - y1, x2 - x1)))
+    if is_horizontal:
+        keep = (ang <= 10) | (ang >= 170)
+        rho, theta = y1[keep], np.pi/2
+    else:
+        keep = np.abs(ang - 90) <= 10
+        rho, theta = x1[keep], 0.0
+    return np.stack([rho, np.full_like(rho, theta)], axis=1).astype(np.float32)
+
+
+def cluster_to_9_lines(lines):
+    # Deterministic 1-D Ward clustering of rho (no KMeans / scikit-learn at inference)
+    if len(lines) < 20:
+        raise RuntimeError(f"Too few candidate lines: {len(lines)}")
+    L = np.array([normalize_line(r,t) for r,t in lines], dtype=np.float64)
+    L = L[np.argsort(L[:,0], kind="stable")]
+    rhos = L[:,0]
+    starts = np.flatnonzero(np.r_[True, np.diff(rhos) > 0.5])
+    counts = np.diff(np.r_[starts, len(rhos)]).astype(np.float64)
+    means = np.add.reduceat(rhos, starts) / counts
+    while len(starts) > 9:
+        cost = counts[:-1] * counts[1:] / (counts[:-1] + counts[1:]) * np.diff(means)**2
+        k = int(np.argmin(cost))
+        total = counts[k] + counts[k+1]
+        means[k] = (means[k]*counts[k] + means[k+1]*counts[k+1]) / total
+        counts[k] = total
+        starts, counts, means = np.delete(starts, k+1), np.delete(counts, k+1), np.delete(means, k+1)
+    if len(starts) < 9:
+        return []
+    return [(float(np.median(rhos[a:b])), float(np.mean(L[a:b,1])))
+            for a, b in zip(starts, np.r_[starts[1:], len(rhos)])]
+
+
+def refine_grid_points(gray, pts, win):
+    # Snap intersections to full-resolution X-corners; points that drift out of the window keep their position
+    if len(pts) == 0 or win < 2:
+        return pts
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.05)
+    refined = cv2.cornerSubPix(gray, pts.reshape(-1,1,2).copy(), (win, win), (-1,-1), criteria).reshape(-1,2)
+    shift = np.linalg.norm(refined - pts, axis=1)
+    return np.where((shift <= win)[:,None], refined, pts).astype(np.float32)
+
+
+def x_at_y(line, y):
+    rho, t = line
+    c, s = math.cos(t), math.sin(t)
+    if abs(c) < 1e-9:
+        return None
+    return (rho - y*s) / c
+
+
+def y_at_x(line, x):
+    rho, t = line
+    c, s = math.cos(t), math.sin(t)
+    if abs(s) < 1e-9:
+        return None
+    return (rho - x*c) / s
+
+
+def sort_vertical_lines_left_to_right(v_lines, img_h):
+    ymid = img_h / 2.0
+    scored = []
+    for line in v_lines:
+        xv = x_at_y(line, ymid)
+        if xv is not None and np.isfinite(xv):
+            scored.append((xv, line))
+    scored.sort(key=lambda z: z[0])
+    return [l for _, l in scored]
+
+
+def sort_horizontal_lines_top_to_bottom(h_lines, img_w):
+    xmid = img_w / 2.0
+    scored = []
+    for line in h_lines:
+        yh = y_at_x(line, xmid)
+        if yh is not None and np.isfinite(yh):
+            scored.append((yh, line))
+    scored.sort(key=lambda z: z[0])
+    return [l for _, l in scored]
+
+
+def intersect(l1, l2):
+    rho1, th1 = l1; rho2, th2 = l2
+    A = np.array([[math.cos(th1), math.sin(th1)],
+                  [math.cos(th2), math.sin(th2)]], dtype=np.float64)
+    b = np.array([rho1, rho2], dtype=np.float64)
+    if abs(np.linalg.det(A)) < 1e-10:
+        return None
+    x, y = np.linalg.solve(A, b)
+    if not (np.isfinite(x) and np.isfinite(y)):
+        return None
+    return np.array([x,y], dtype=np.float64)
+
+
+def _fit_homography_from_9x9_lines(gray, board_px=512, max_side=LOCALIZE_MAX_SIDE):
+    # Lines are detected on a downscaled copy, intersections refined at full resolution
+    Himg, Wimg = gray.shape[:2]
+    scale = min(1.0, max_side / max(Himg, Wimg)) if max_side else 1.0
+    small = gray
+    if scale < 1.0:
+        small = cv2.resize(gray, (round(Wimg*scale), round(Himg*scale)), interpolation=cv2.INTER_AREA)
+    h_small, w_small = small.shape[:2]
+    h_mask, v_mask = extract_grid_masks(small)
+    h_candidates = hough_mask_lines(h_mask, True)
+    v_candidates = hough_mask_lines(v_mask, False)
+    if len(h_candidates) < 9 or len(v_candidates) < 9:
+        return None
+    h9 = sort_horizontal_lines_top_to_bottom(cluster_to_9_lines(h_candidates), w_small)
+    v9 = sort_vertical_lines_left_to_right(cluster_to_9_lines(v_candidates), h_small)
+    if len(h9) != 9 or len(v9) != 9:
+        return None
+    src_pts, dst_pts = [], []
+    for i, h in enumerate(h9):
+        for j, v in enumerate(v9):
+            p = intersect(h, v)
+            if p is None:
+                continue
+            x,y = p
+            if x < -0.02*w_small or x > 1.02*w_small or y < -0.02*h_small or y > 1.02*h_small:
+                continue
+            src_pts.append([x,y]); dst_pts.append([j,i])
+    src_pts = np.asarray(src_pts, np.float32) / scale
+    dst_pts = np.asarray(dst_pts, np.float32)
+    if len(src_pts) < 70:
+        return None
+    square_px = abs(v9[-1][0] - v9[0][0]) / 8.0 / scale
+    src_pts = refine_grid_points(gray, src_pts, win=max(2, int(0.25 * square_px)))
+    H_grid, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, ransacReprojThreshold=1.5)
+    if H_grid is None:
+        return None
+    S = np.array([[board_px/8.0, 0, 0],
+                  [0, board_px/8.0, 0],
+                  [0, 0, 1]], dtype=np.float64)
+    return S @ H_grid
+
+
+def preprocess_board_real(img_bgr, out_size=512, fallback=True):
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    H_px = _fit_homography_from_9x9_lines(gray, board_px=out_size)
+    if H_px is not None:
+        return cv2.warpPerspective(img_bgr, H_px, (out_size, out_size)), {"method":"hough_grid"}
+    if fallback:
+        h,w = img_bgr.shape[:2]
+        s = min(h,w)
+        crop = img_bgr[(h-s)//2:(h+s)//2, (w-s)//2:(w+s)//2].copy()
+        return cv2.resize(crop, (out_size,out_size), interpolation=cv2.INTER_AREA), {"method":"fallback_center"}
+    return cv2.resize(img_bgr, (out_size,out_size)), {"method":"failed"}
+
+
+def checkerboard_score(board_bgr):
+    # |correlation| of the 8x8 square means with a checkerboard; ~0 when the warp is off
+    gray = cv2.cvtColor(board_bgr, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    step = gray.shape[0] // 8
+    g = gray[:step*8, :step*8].reshape(8, step, 8, step).mean(axis=(1,3))
+    g = (g - g.mean()) / (g.std() + 1e-6)
+    rr, cc = np.indices((8,8))
+    return float(abs(np.mean(g * (((rr + cc) % 2) * 2 - 1))))
+
+
+class BoardTracker:
+    # Ordered frames from a static camera: reuse the last homography, re-detect only when
+    # the warped board stops looking like a checkerboard. history: "tracked"/"redetected"/"fallback"
+    def __init__(self, out_size=512, min_quality=0.14, rel_drop=0.8):
+        self.out_size, self.min_quality, self.rel_drop = out_size, min_quality, rel_drop
+        self.H, self.frame_shape, self.ref_quality, self.history = None, None, 0.0, []
+
+    def warp(self, img_bgr):
+        size = (self.out_size, self.out_size)
+        if self.H is not None and img_bgr.shape[:2] == self.frame_shape:
+            board = cv2.warpPerspective(img_bgr, self.H, size)
+            if checkerboard_score(board) >= max(self.min_quality, self.rel_drop * self.ref_quality):
+                self.history.append("tracked")
+                return board, {"method":"tracked"}
+        H_px = _fit_homography_from_9x9_lines(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY), board_px=self.out_size)
+        if H_px is None:
+            self.history.append("fallback")
+            return preprocess_board_real(img_bgr, out_size=self.out_size, fallback=True)
+        board = cv2.warpPerspective(img_bgr, H_px, size)
+        self.H, self.frame_shape, self.ref_quality = H_px, img_bgr.shape[:2], checkerboard_score(board)
+        self.history.append("redetected")
+        return board, {"method":"hough_grid"}
@@ -0,0 +1,321 @@
+"""
+Local board recognition service: HTTP over TCP or a Unix socket, asyncio + stdlib only.
+
+    POST /predict     body = encoded image bytes (jpg / png / ...)
+                      -> {"fen", "squares": 8x8 CLASSES names, "confidence": 8x8 softmax
+                          probabilities, "min_confidence", "warp_method", "timing_ms"}
+    GET  /metrics     queue depth, batch-size and latency histograms, counters (JSON)
+    GET  /healthz     {"ok": true, "model": ...}
+
+Concurrent requests are served as follows:
+    decode + board warp   process pool (--warp-workers), one task per request
+    classification        one model thread; warped boards of concurrent requests are
+                          gathered into one batch of up to --max-batch boards, waiting
+                          at most --max-wait-ms after the first board of the batch
+so a single caller sees one board per forward pass and no extra latency beyond
+--max-wait-ms, while many callers share 64 x B crop batches.
+
+Usage:
+    python board_server.py best_train.fp16.bundle --port 8765
+    python board_server.py best_train.pt --unix /tmp/chess.sock --max-batch 16 --max-wait-ms 10
+
+    curl --data-binary @frame.jpg http://127.0.0.1:8765/predict
+    curl --unix-socket /tmp/chess.sock http://localhost/metrics
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+from board_localization import preprocess_board_real
+from occupancy_filter import OccupancyFilter
+from square_model import CLASSES, classify_boards, grid_to_fen_placement, load_inference_model
+
+BOARD_PX = 512
+MAX_BODY_BYTES = 32 * 1024 * 1024
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+BATCH_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+
+class Histogram:
+    """Per-bucket (not cumulative) counts: counts[i] = observations in (bounds[i-1], bounds[i]]; the last is overflow"""
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.n += 1
+
+    def snapshot(self):
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {"buckets": dict(zip(labels, self.counts)), "count": self.n,
+                "mean": self.total / self.n if self.n else None}
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.warp_methods = {}
+        self.batch_size = Histogram(BATCH_BUCKETS)
+        self.latency = {stage: Histogram(LATENCY_BUCKETS_MS) for stage in ("total", "warp", "queue", "model")}
+
+    def snapshot(self, queue_depth, in_flight):
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": in_flight,
+            "queue_depth": queue_depth,
+            "warp_methods": dict(self.warp_methods),
+            "batch_size": self.batch_size.snapshot(),
+            "latency_ms": {stage: h.snapshot() for stage, h in self.latency.items()},
+        }
+
+
+def _warp_worker_init():
+    # Ctrl-C reaches the whole process group: the server shuts the pool down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def decode_and_warp(data):
+    """Process pool task: encoded image bytes -> (board_bgr or None, warp method)"""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None, "decode_fail"
+    board, dbg = preprocess_board_real(img, out_size=BOARD_PX, fallback=True)
+    return board, dbg.get("method", "?")
+
+
+class MicroBatcher:
+    """
+    Gathers boards submitted by concurrent requests into batches of up to max_batch,
+    closing a batch max_wait_ms after its first board (or when it is full), and runs
+    each batch on the model thread.
+    """
+    def __init__(self, model, device, metrics, max_batch=16, max_wait_ms=5.0, prefilter=None):
+        self.model = model
+        self.prefilter = prefilter
+        self.device = device
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+        self.runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.runner.shutdown(wait=True)
+
+    async def classify(self, board):
+        """(64,) class indices, (64,) confidences and the seconds spent queued, for one warped board"""
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((board, fut, time.perf_counter()))
+        return await fut
+
+    def _run(self, boards):
+        return classify_boards(self.model, np.stack(boards), device=self.device,
+                               max_crops=64 * self.max_batch, with_confidence=True, prefilter=self.prefilter)
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Whatever arrived while waiting for the first board goes in as well (up to max_batch)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            start = time.perf_counter()
+            self.metrics.batch_size.observe(len(batch))
+            try:
+                preds, confs = await loop.run_in_executor(self.runner, self._run, [b for b, _, _ in batch])
+            except Exception as e:  # a failed batch fails its requests, not the server
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            model_ms = 1000.0 * (time.perf_counter() - start)
+            for i, (_, fut, queued_at) in enumerate(batch):
+                self.metrics.latency["queue"].observe(1000.0 * (start - queued_at))
+                self.metrics.latency["model"].observe(model_ms)
+                if not fut.done():
+                    fut.set_result((preds[i], confs[i], start - queued_at))
+
+
+class BoardServer:
+    def __init__(self, model, device="cpu", warp_workers=2, max_batch=16, max_wait_ms=5.0, model_name="model",
+                 prefilter=None):
+        self.metrics = Metrics()
+        self.model_name = model_name
+        self.warpers = ProcessPoolExecutor(max_workers=warp_workers, initializer=_warp_worker_init)
+        # Start the workers before the event loop creates any thread (forking a threaded process is unsafe)
+        self.warpers.submit(int).result()
+        self.batcher = MicroBatcher(model, device, self.metrics, max_batch=max_batch, max_wait_ms=max_wait_ms,
+                                    prefilter=prefilter)
+        self.in_flight = 0
+
+    async def predict(self, data):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        board, method = await loop.run_in_executor(self.warpers, decode_and_warp, data)
+        warp_s = time.perf_counter() - start
+        self.metrics.latency["warp"].observe(1000.0 * warp_s)
+        self.metrics.warp_methods[method] = self.metrics.warp_methods.get(method, 0) + 1
+        if board is None:
+            return 422, {"error": "could not decode the image", "warp_method": method}
+
+        preds, confs, queue_s = await self.batcher.classify(board)
+        grid = preds.reshape(8, 8)
+        total_s = time.perf_counter() - start
+        self.metrics.latency["total"].observe(1000.0 * total_s)
+        return 200, {
+            "fen": grid_to_fen_placement(grid),
+            "squares": [[CLASSES[int(i)] for i in row] for row in grid],
+            "confidence": np.round(confs.reshape(8, 8).astype(np.float64), 4).tolist(),
+            "min_confidence": round(float(confs.min()), 4),
+            "warp_method": method,
+            "timing_ms": {"warp": round(1000.0 * warp_s, 2), "queue": round(1000.0 * queue_s, 2),
+                          "total": round(1000.0 * total_s, 2)},
+        }
+
+    async def route(self, method, path, body):
+        path = path.split("?", 1)[0]
+        if path == "/predict":
+            if method != "POST":
+                return 405, {"error": "POST the image bytes"}
+            if not body:
+                return 400, {"error": "empty body"}
+            return await self.predict(body)
+        if path == "/metrics" and method == "GET":
+            return 200, self.metrics.snapshot(self.batcher.queue.qsize(), self.in_flight)
+        if path == "/healthz" and method == "GET":
+            return 200, {"ok": True, "model": self.model_name}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def handle(self, reader, writer):
+        """Minimal HTTP/1.1: Content-Length bodies, keep-alive unless the client sends Connection: close"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0) or 0)
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                if len(parts) < 2:
+                    status, payload = 400, {"error": "malformed request line"}
+                elif length > MAX_BODY_BYTES:
+                    status, payload, keep_alive = 413, {"error": f"body larger than {MAX_BODY_BYTES} bytes"}, False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    self.metrics.requests += 1
+                    self.in_flight += 1
+                    try:
+                        status, payload = await self.route(parts[0].upper(), parts[1], body)
+                    except Exception as e:
+                        status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                    finally:
+                        self.in_flight -= 1
+                if status >= 400:
+                    self.metrics.errors += 1
+
+                out = json.dumps(payload).encode("utf-8")
+                writer.write((f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                              f"Content-Type: application/json\r\nContent-Length: {len(out)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1") + out)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix=None, ready=None):
+        """Serve until cancelled. ready: optional asyncio.Event set once the socket listens (and self.address is set)"""
+        self.batcher.start()
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, path=unix)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+        # The bound (host, port) - port=0 picks a free one - or the socket path
+        self.address = unix or server.sockets[0].getsockname()[:2]
+        where = unix or "http://{}:{}".format(*self.address)
+        print(f"Serving {self.model_name} on {where}")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+            self.warpers.shutdown(wait=True)
+            if unix and os.path.exists(unix):
+                os.remove(unix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local board recognition service with micro-batching")
+    parser.add_argument("checkpoint", help="model checkpoint (.pt), .bundle, or a .ts / .onnx from export_model.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--warp-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--max-batch", type=int, default=16, help="boards per forward pass (x64 crops)")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="how long a batch waits for more boards after its first one")
+    parser.add_argument("--prefilter", default=None,
+                        help="occupancy_filter.py JSON: squares it calls empty skip the square model")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    model = load_inference_model(args.checkpoint, device=args.device)
+    server = BoardServer(model, device=args.device, warp_workers=args.warp_workers, max_batch=args.max_batch,
+                         max_wait_ms=args.max_wait_ms, model_name=os.path.basename(args.checkpoint),
+                         prefilter=OccupancyFilter.load(args.prefilter) if args.prefilter else None)
+    try:
+        asyncio.run(server.serve(host=args.host, port=args.port, unix=args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
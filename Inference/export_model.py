@@ -0,0 +1,247 @@
+"""
+Export a trained checkpoint to a CPU inference graph, with a parity report.
+
+Variants (--variants, any subset):
+    torchscript        traced + frozen fp32 graph, channels-last        -> <name>.fp32.ts
+    torchscript-int8   post-training static int8 (FX graph mode),
+                       calibrated on real validation boards              -> <name>.int8.ts
+    onnx               fp32 ONNX graph, dynamic batch                    -> <name>.fp32.onnx
+    onnx-int8          onnxruntime static int8 (QDQ) of the ONNX graph   -> <name>.int8.onnx
+The ONNX variants need the onnx / onnxruntime packages.
+
+Crops are cut with the checkpoint's own preprocessing (crop size cfg["cube"], mean / std
+from its cfg, else the training notebook's ImageNet normalisation; --crop-size / --mean /
+--std override it), which is also written to <artifact>.preprocess.json for
+load_inference_model().
+
+The validation boards come from real game folders (a CSV with a frame column and
+fen, next to an images/ or tagged_images/ folder - the chess_data/real layout).
+They are warped once, split into calibration and parity boards, and every artifact
+is written with <artifact>.parity.json:
+    square accuracy and board exact-match of the eager and the exported model against
+    the ground truth, their square / board agreement, the max |logit difference| and
+    the CPU latency per board.
+
+Exported models load with square_model.load_inference_model() and plug into
+predict_folder.py (or predict_board in final_model.ipynb) in place of the eager model.
+
+Usage:
+    python export_model.py best_train.pt --val-games ../chess_data/real/game2_per_frame ../chess_data/real/game4_per_frame
+    python export_model.py best_train.pt --val-games ... --variants torchscript-int8 onnx --out-dir exported
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import torch
+
+from board_localization import preprocess_board_real
+from square_model import (batch_context_crops, fen_to_grid, load_checkpoint_flexible, load_inference_model,
+                          write_preprocess)
+
+VARIANTS = ["torchscript", "torchscript-int8", "onnx", "onnx-int8"]
+FRAME_COLUMNS = ["from_frame", "frame", "frame_id", "image_id", "to_frame"]
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+LAST_NUMBER = re.compile(r"(\d+)\D*$")
+
+
+def game_frames(game_dir):
+    """[(image_path, fen)] of a real game folder, matched on the last number of the image name"""
+    csvs = sorted(glob.glob(os.path.join(game_dir, "*.csv")))
+    images_dir = next((os.path.join(game_dir, n) for n in ["images", "tagged_images"]
+                       if os.path.isdir(os.path.join(game_dir, n))), None)
+    if not csvs or images_dir is None:
+        print(f"Skipping {game_dir}: no CSV or images folder")
+        return []
+    df = pd.read_csv(csvs[0])
+    frame_col = next((c for c in FRAME_COLUMNS if c in df.columns), None)
+    if frame_col is None or "fen" not in df.columns:
+        print(f"Skipping {game_dir}: no frame/fen columns in {csvs[0]}")
+        return []
+    frames = {}
+    for name in sorted(os.listdir(images_dir)):
+        m = LAST_NUMBER.search(os.path.splitext(name)[0])
+        if m and name.lower().endswith(IMAGE_EXTS):
+            frames.setdefault(int(m.group(1)), os.path.join(images_dir, name))
+    out = []
+    for frame, fen in zip(pd.to_numeric(df[frame_col], errors="coerce"), df["fen"].astype(str)):
+        if frame == frame and int(frame) in frames:
+            out.append((frames[int(frame)], fen))
+    return out
+
+
+def _warp(path):
+    import cv2
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    return None if img is None else preprocess_board_real(img, out_size=512, fallback=True)[0]
+
+
+def load_val_boards(game_dirs, max_boards, workers, seed=0):
+    """(boards (N, 512, 512, 3) uint8, labels (N, 64) int64) from a random subset of the game frames"""
+    items = [it for d in game_dirs for it in game_frames(d)]
+    rng = np.random.default_rng(seed)
+    items = [items[i] for i in rng.permutation(len(items))[:max_boards]]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        boards = list(pool.map(_warp, [p for p, _ in items], chunksize=4))
+    keep = [i for i, b in enumerate(boards) if b is not None]
+    labels = np.stack([fen_to_grid(items[i][1]).reshape(-1) for i in keep])
+    return np.stack([boards[i] for i in keep]), labels
+
+
+def crop_batches(boards, pre, boards_per_batch=8):
+    for i in range(0, len(boards), boards_per_batch):
+        yield batch_context_crops(boards[i:i + boards_per_batch], k=pre["context_k"], out_size=pre["crop_size"],
+                                  mean=pre["mean"], std=pre["std"])
+
+
+def run_model(model, boards, pre):
+    """(logits (N*64, C) float32, seconds)"""
+    out = []
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for crops in crop_batches(boards, pre):
+            out.append(model(crops).float())
+    return torch.cat(out), time.perf_counter() - start
+
+
+def quantize_int8_fx(model, calib_boards, pre):
+    """Post-training static int8 quantization (FX graph mode), observers fed with calibration crops"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    torch.backends.quantized.engine = engine
+    example = torch.zeros(1, 3, pre["crop_size"], pre["crop_size"])
+    prepared = prepare_fx(copy.deepcopy(model).cpu().eval(), get_default_qconfig_mapping(engine), (example,))
+    with torch.inference_mode():
+        for crops in crop_batches(calib_boards, pre):
+            prepared(crops)
+    return convert_fx(prepared)
+
+
+def export_torchscript(model, path, crop_size):
+    model = model.to(memory_format=torch.channels_last)
+    example = torch.zeros(8, 3, crop_size, crop_size).contiguous(memory_format=torch.channels_last)
+    with torch.inference_mode():
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+    torch.jit.save(traced, path)
+
+
+def export_onnx(model, path, crop_size):
+    example = torch.zeros(8, 3, crop_size, crop_size)
+    torch.onnx.export(model, (example,), path, input_names=["crops"], output_names=["logits"],
+                      dynamic_axes={"crops": {0: "n"}, "logits": {0: "n"}}, opset_version=17)
+
+
+def quantize_onnx_int8(fp32_path, path, calib_boards, pre):
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, quantize_static
+
+    class CropReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = ({"crops": crops.numpy()} for crops in crop_batches(calib_boards, pre))
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    quantize_static(fp32_path, path, CropReader(), quant_format=QuantFormat.QDQ)
+
+
+def parity_report(eager_logits, eager_s, artifact_logits, artifact_s, labels):
+    y = torch.from_numpy(labels.reshape(-1))
+    n_boards = len(labels)
+    e_pred, a_pred = eager_logits.argmax(1), artifact_logits.argmax(1)
+
+    def scores(pred):
+        correct = (pred == y).view(n_boards, 64)
+        return {"square_acc": float(correct.float().mean()), "board_exact": float(correct.all(1).float().mean())}
+
+    same = (a_pred == e_pred).view(n_boards, 64)
+    return {
+        "boards": n_boards,
+        "eager": scores(e_pred),
+        "exported": scores(a_pred),
+        "agreement_with_eager": {"square": float(same.float().mean()), "board": float(same.all(1).float().mean())},
+        "max_abs_logit_diff": float((artifact_logits - eager_logits).abs().max()),
+        "ms_per_board": {"eager": 1000.0 * eager_s / n_boards, "exported": 1000.0 * artifact_s / n_boards},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a checkpoint for CPU inference, with a parity report")
+    parser.add_argument("checkpoint", help="training checkpoint, e.g. best_train.pt")
+    parser.add_argument("--val-games", nargs="+", required=True, help="real game folders (CSV + images/)")
+    parser.add_argument("--variants", nargs="+", default=["torchscript", "torchscript-int8"], choices=VARIANTS)
+    parser.add_argument("--out-dir", default="exported")
+    parser.add_argument("--max-boards", type=int, default=300, help="validation boards used in total")
+    parser.add_argument("--calib-boards", type=int, default=32, help="of those, boards used for int8 calibration")
+    parser.add_argument("--warp-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--crop-size", type=int, default=None, help="default: cfg['cube'] of the checkpoint, else 96")
+    parser.add_argument("--context-k", type=float, default=None, help="default: 1.6")
+    parser.add_argument("--mean", type=float, nargs=3, default=None, help="default: cfg['mean'], else ImageNet")
+    parser.add_argument("--std", type=float, nargs=3, default=None, help="default: cfg['std'], else ImageNet")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.checkpoint))[0]
+    eager = load_checkpoint_flexible(args.checkpoint, device="cpu")
+    if getattr(eager, "board_level", False):
+        parser.error(f"{args.checkpoint} is a board-level model (BoardFCN, Exp D); export_model.py exports crop "
+                     "classifiers (64 crops per board) only")
+    pre = dict(eager.preprocess)
+    for key, value in [("crop_size", args.crop_size), ("context_k", args.context_k), ("mean", args.mean), ("std", args.std)]:
+        if value is not None:
+            pre[key] = list(value) if isinstance(value, (list, tuple)) else value
+    print("Preprocessing:", pre)
+
+    boards, labels = load_val_boards(args.val_games, args.max_boards, args.warp_workers)
+    if len(boards) == 0:
+        parser.error("no validation boards found")
+    # Calibration and parity boards are disjoint when there are enough boards
+    n_calib = min(args.calib_boards, len(boards) // 2) or len(boards)
+    calib_boards = boards[:n_calib]
+    parity_boards, parity_labels = (boards[n_calib:], labels[n_calib:]) if n_calib < len(boards) else (boards, labels)
+    print(f"{len(boards)} validation boards: {n_calib} for calibration, {len(parity_boards)} for parity")
+
+    eager_logits, eager_s = run_model(eager, parity_boards, pre)
+    for variant in args.variants:
+        if variant == "torchscript":
+            path = os.path.join(args.out_dir, f"{name}.fp32.ts")
+            export_torchscript(copy.deepcopy(eager), path, pre["crop_size"])
+        elif variant == "torchscript-int8":
+            path = os.path.join(args.out_dir, f"{name}.int8.ts")
+            export_torchscript(quantize_int8_fx(eager, calib_boards, pre), path, pre["crop_size"])
+        elif variant == "onnx":
+            path = os.path.join(args.out_dir, f"{name}.fp32.onnx")
+            export_onnx(eager, path, pre["crop_size"])
+        else:
+            fp32_path = os.path.join(args.out_dir, f"{name}.fp32.onnx")
+            if not os.path.exists(fp32_path):
+                export_onnx(eager, fp32_path, pre["crop_size"])
+                write_preprocess(fp32_path, pre)
+            path = os.path.join(args.out_dir, f"{name}.int8.onnx")
+            quantize_onnx_int8(fp32_path, path, calib_boards, pre)
+        write_preprocess(path, pre)
+
+        artifact = load_inference_model(path, device="cpu")
+        artifact_logits, artifact_s = run_model(artifact, parity_boards, artifact.preprocess)
+        report = {"artifact": os.path.basename(path), "checkpoint": os.path.abspath(args.checkpoint),
+                  "variant": variant, "calibration_boards": n_calib if variant.endswith("int8") else 0,
+                  "preprocess": pre,
+                  **parity_report(eager_logits, eager_s, artifact_logits, artifact_s, parity_labels)}
+        with open(path + ".parity.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"{report['artifact']}: square acc {report['exported']['square_acc']:.4f} "
+              f"(eager {report['eager']['square_acc']:.4f}), board exact {report['exported']['board_exact']:.4f} "
+              f"(eager {report['eager']['board_exact']:.4f}), agreement {report['agreement_with_eager']['square']:.4f}, "
+              f"{report['ms_per_board']['exported']:.1f} vs {report['ms_per_board']['eager']:.1f} ms/board")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Slim inference bundle: everything a worker needs to classify squares, nothing else.
+
+A training checkpoint (save_checkpoint in training_notebook.ipynb) carries the
+optimizer state, is unpickled in full (weights_only=False) and leaves the
+architecture to be guessed from its key names and the crop preprocessing to
+notebook code. A bundle (<name>.bundle) is a torch.save file of plain types and
+tensors only:
+    format, version     "chess-square-bundle", BUNDLE_VERSION
+    arch                {"name": resnet18 | resnet34 | efficientnet_b0 | board_fcn, "num_classes", "dropout"}
+    classes             output column order of the model
+    preprocess          {"board_px", "crop_size", "context_k", "mean", "std", "channels"}
+    source              {"checkpoint", "epoch", "cfg", "best_metric"} (informational)
+    state_dict          fp16 or fp32 weights
+so it loads with torch.load(weights_only=True, mmap=True): tensors are paged in
+from the file instead of being read and copied up front.
+
+This module imports only the standard library at import time; torch and the model
+code are imported by the functions that need them, and ResNet bundles never import
+torchvision (square_model.py builds the ResNets itself).
+
+Usage:
+    python model_bundle.py best_train.pt                          # -> best_train.fp16.bundle
+    python model_bundle.py best_train.pt --dtype fp32 --out model.bundle
+    python model_bundle.py --info model.bundle
+
+    model = square_model.load_inference_model("best_train.fp16.bundle", device="cuda")
+"""
+import argparse
+import json
+import os
+
+BUNDLE_FORMAT = "chess-square-bundle"
+BUNDLE_VERSION = 1
+DTYPES = {"fp16": "float16", "fp32": "float32"}
+ARCH_NAMES = {"resnet": "resnet18", "resnet34": "resnet34", "efficientnet": "efficientnet_b0", "board_fcn": "board_fcn"}
+
+
+def _plain(obj):
+    """cfg dicts may hold tuples / numpy scalars: keep what json can represent (weights_only loads it back)"""
+    return json.loads(json.dumps(obj, default=str))
+
+
+def write_bundle(checkpoint, out, dtype="fp16", crop_size=None, context_k=1.6, mean=None, std=None, board_px=None):
+    """
+    Training checkpoint -> bundle at `out`. The preprocessing defaults to the checkpoint's own
+    (square_model.checkpoint_preprocess: cfg["cube"] / cfg["warp"] / cfg["mean"] / cfg["std"], else
+    96 / 512 and the training notebook's ImageNet normalisation); board-level models normalise internally.
+    """
+    import torch
+    from square_model import CLASSES, checkpoint_preprocess, infer_model_type_from_state_dict
+
+    ckpt = torch.load(checkpoint, map_location="cpu", weights_only=False)
+    sd = ckpt["model_state"] if isinstance(ckpt, dict) and "model_state" in ckpt else ckpt
+    meta = ckpt if isinstance(ckpt, dict) and "model_state" in ckpt else {}
+    cfg = meta.get("cfg") or {}
+
+    mtype = infer_model_type_from_state_dict(sd)
+    if mtype not in ARCH_NAMES:
+        raise ValueError(f"{checkpoint}: cannot tell the architecture from the state dict")
+    classes = list(meta.get("classes") or CLASSES)
+    target = getattr(torch, DTYPES[dtype])
+    # Only floating point tensors are cast (BatchNorm's num_batches_tracked stays int64)
+    state = {k: (v.to(target) if v.is_floating_point() else v).contiguous() for k, v in sd.items()}
+
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "arch": {"name": ARCH_NAMES[mtype], "num_classes": len(classes),
+                 "dropout": float(cfg.get("dropout", 0.2))},
+        "classes": classes,
+        "preprocess": checkpoint_preprocess(cfg, crop_size=crop_size, context_k=context_k, mean=mean, std=std,
+                                            board_px=board_px),
+        "source": {"checkpoint": os.path.basename(checkpoint), "epoch": meta.get("epoch"),
+                   "cfg": _plain(cfg), "best_metric": meta.get("best_metric", meta.get("best_val_acc"))},
+        "state_dict": state,
+    }
+    tmp = out + ".tmp"
+    torch.save(bundle, tmp)
+    os.replace(tmp, out)
+    return out
+
+
+def read_bundle(path):
+    """The bundle dict, tensors memory-mapped; raises ValueError for other files / newer versions"""
+    import torch
+
+    bundle = torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"{path} is not a {BUNDLE_FORMAT} file")
+    if int(bundle.get("version", 0)) > BUNDLE_VERSION:
+        raise ValueError(f"{path}: bundle version {bundle['version']} is newer than this loader ({BUNDLE_VERSION})")
+    return bundle
+
+
+def build_model(arch):
+    # Built on the CPU rather than the meta device: the first meta-device construction
+    # costs seconds of one-off registration, more than the random init it saves
+    from square_model import BoardFCN, EfficientNetSquareClassifier, SquareClassifier
+
+    if arch["name"] == "board_fcn":
+        return BoardFCN(num_classes=arch["num_classes"], dropout=arch["dropout"])
+    if arch["name"] == "efficientnet_b0":
+        return EfficientNetSquareClassifier(num_classes=arch["num_classes"], dropout=arch["dropout"])
+    return SquareClassifier(num_classes=arch["num_classes"], dropout=arch["dropout"], backbone=arch["name"])
+
+
+def load_bundle(path, device="cpu", dtype=None, channels_last=True):
+    """
+    Bundle -> square_model.InferenceModel (eval mode, preprocess config attached).
+    dtype: compute dtype; default fp16 weights on CUDA and fp32 on the CPU (fp16 CPU
+    convolutions are slow), whatever the bundle stores.
+    """
+    import torch
+
+    from square_model import CLASSES, InferenceModel
+
+    bundle = read_bundle(path)
+    device = torch.device(device)
+    if dtype is None:
+        stored = next((v.dtype for v in bundle["state_dict"].values() if v.is_floating_point()), torch.float32)
+        dtype = stored if device.type == "cuda" else torch.float32
+    model = build_model(bundle["arch"])
+    state = bundle["state_dict"]
+    if device.type == "cpu" and all(v.dtype == dtype for v in state.values() if v.is_floating_point()):
+        # Keep the memory-mapped tensors as the parameters: nothing is copied up front
+        model.load_state_dict(state, strict=True, assign=True)
+    else:
+        model.load_state_dict({k: (v.to(device, dtype) if v.is_floating_point() else v.to(device))
+                               for k, v in state.items()}, strict=True, assign=True)
+    model.eval()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    classes = list(bundle["classes"])
+    class_index = None
+    if classes != CLASSES:
+        class_index = torch.tensor([classes.index(c) for c in CLASSES], dtype=torch.int64)
+    return InferenceModel(model, channels_last=channels_last, kind="bundle", preprocess=bundle["preprocess"],
+                          class_index=class_index, dtype=dtype)
+
+
+def bundle_info(path):
+    """Everything but the weights, plus the parameter count and stored dtype"""
+    bundle = read_bundle(path)
+    state = bundle.pop("state_dict")
+    bundle["parameters"] = int(sum(v.numel() for v in state.values() if v.is_floating_point()))
+    bundle["dtype"] = str(next(v.dtype for v in state.values() if v.is_floating_point())).replace("torch.", "")
+    bundle["file_mb"] = round(os.path.getsize(path) / 2**20, 2)
+    return bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a training checkpoint to a slim inference bundle")
+    parser.add_argument("checkpoint", nargs="?", help="training checkpoint, e.g. best_train.pt")
+    parser.add_argument("--out", default=None, help="default: <checkpoint name>.<dtype>.bundle next to it")
+    parser.add_argument("--dtype", default="fp16", choices=list(DTYPES))
+    parser.add_argument("--crop-size", type=int, default=None, help="default: cfg['cube'] of the checkpoint, else 96")
+    parser.add_argument("--context-k", type=float, default=1.6)
+    parser.add_argument("--mean", type=float, nargs=3, default=None, help="default: cfg['mean'], else ImageNet")
+    parser.add_argument("--std", type=float, nargs=3, default=None, help="default: cfg['std'], else ImageNet")
+    parser.add_argument("--info", metavar="BUNDLE", default=None, help="print the metadata of a bundle and exit")
+    args = parser.parse_args()
+
+    if args.info:
+        print(json.dumps(bundle_info(args.info), indent=2))
+        return
+    if not args.checkpoint:
+        parser.error("a checkpoint (or --info BUNDLE) is required")
+    out = args.out or os.path.splitext(args.checkpoint)[0] + f".{args.dtype}.bundle"
+    write_bundle(args.checkpoint, out, dtype=args.dtype, crop_size=args.crop_size, context_k=args.context_k,
+                 mean=args.mean, std=args.std)
+    print(f"{out}: {os.path.getsize(out) / 2**20:.1f} MB "
+          f"(checkpoint {os.path.getsize(args.checkpoint) / 2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
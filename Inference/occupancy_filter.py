@@ -0,0 +1,227 @@
+"""
+Empty-square pre-filter: a cheap occupancy test in front of the square classifier.
+
+About half of the 64 squares are empty in a typical position. The filter scores every
+square of a warped board from a few texture / colour statistics of its inner region
+(gray std, gradient energy, edge density, brightness and colour distance to the
+board's own empty-square reference for that square colour), combined by a logistic
+regression fitted on fen_to_grid occupancy labels. The decision threshold is
+calibrated to a target false-negative rate (occupied squares called empty); only
+squares above it go through the CNN, the rest are predicted "empty".
+
+The fitted filter is a small JSON file (feature standardisation, weights, threshold)
+used by classify_boards(..., prefilter=OccupancyFilter.load(path)), predict_folder.py
+and board_server.py (--prefilter).
+
+Usage:
+    python occupancy_filter.py best_train.pt --train-games ../chess_data/real/game2_per_frame \\
+        --val-games ../chess_data/real/game4_per_frame --target-fnr 0.002 --out occupancy.json
+fits on the train games, calibrates the threshold on half of the val boards and
+benchmarks the cascade against the single-stage model on the other half
+(backbone crops per board, ms per board, square accuracy, board exact-match) ->
+<out>.benchmark.json.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+FEATURES = ["gray_std", "grad_mean", "edge_frac", "gray_dev", "color_dev", "grad_rel"]
+FEATURE_PX = 256    # boards are scored at 32 px per square
+INNER = 0.2         # fraction of the square side ignored on each edge (grid lines, neighbour spill)
+
+
+def square_features(boards, device=None):
+    """
+    (N, S, S, 3) uint8 BGR warped boards (numpy or tensor) -> (N, 64, len(FEATURES)) float32 numpy,
+    squares in order r*8+c.
+    """
+    x = boards if torch.is_tensor(boards) else torch.from_numpy(np.ascontiguousarray(boards))
+    if device is not None:
+        x = x.to(device)
+    x = x.permute(0, 3, 1, 2).float()
+    if x.shape[-1] != FEATURE_PX:
+        x = torch.nn.functional.interpolate(x, size=(FEATURE_PX, FEATURE_PX), mode="area")
+    n, sq = x.shape[0], FEATURE_PX // 8
+    gray = (0.114 * x[:, 0] + 0.587 * x[:, 1] + 0.299 * x[:, 2]).unsqueeze(1)
+    gx = gray[..., :, 2:] - gray[..., :, :-2]
+    gy = gray[..., 2:, :] - gray[..., :-2, :]
+    grad = torch.nn.functional.pad(gx[..., 1:-1, :].abs() + gy[..., :, 1:-1].abs(), (1, 1, 1, 1))
+
+    def squares(t):
+        """(N, C, P, P) -> (N, 64, C, inner, inner): the inner region of every square"""
+        c = t.shape[1]
+        t = t.reshape(n, c, 8, sq, 8, sq).permute(0, 2, 4, 1, 3, 5).reshape(n, 64, c, sq, sq)
+        m = int(round(INNER * sq))
+        return t[..., m:sq - m, m:sq - m]
+
+    g, gr, col = squares(gray), squares(grad), squares(x)
+    gray_mean = g.mean(dim=(2, 3, 4))
+    gray_std = g.std(dim=(2, 3, 4))
+    grad_mean = gr.mean(dim=(2, 3, 4))
+    board_grad = grad_mean.median(dim=1, keepdim=True).values.clamp_min(1.0)
+    edge_frac = (gr > 2.0 * board_grad[..., None, None, None]).float().mean(dim=(2, 3, 4))
+    color_mean = col.mean(dim=(3, 4))                                   # (N, 64, 3)
+
+    # Reference per square colour (light / dark by parity): the median over those 32 squares,
+    # which are mostly empty in any position
+    parity = torch.tensor([(r + c) % 2 for r in range(8) for c in range(8)], device=x.device)
+    gray_dev = torch.zeros_like(gray_mean)
+    color_dev = torch.zeros_like(gray_mean)
+    for p in (0, 1):
+        sel = parity == p
+        ref_gray = gray_mean[:, sel].median(dim=1, keepdim=True).values
+        ref_col = color_mean[:, sel].median(dim=1, keepdim=True).values
+        gray_dev[:, sel] = (gray_mean[:, sel] - ref_gray).abs()
+        color_dev[:, sel] = (color_mean[:, sel] - ref_col).norm(dim=2)
+    feats = torch.stack([gray_std, grad_mean, edge_frac, gray_dev, color_dev, grad_mean / board_grad], dim=2)
+    return feats.cpu().numpy().astype(np.float32)
+
+
+def _design(feats):
+    """Features -> model inputs: log1p of the non-negative statistics"""
+    return np.log1p(np.maximum(feats, 0.0)).reshape(-1, feats.shape[-1])
+
+
+class OccupancyFilter:
+    """Logistic regression over square_features(); occupied = probability >= threshold"""
+    def __init__(self, mean, std, weights, bias, threshold=0.5, target_fnr=None):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.threshold = float(threshold)
+        self.target_fnr = target_fnr
+
+    @classmethod
+    def fit(cls, boards, labels, l2=1e-3, iters=25):
+        """boards (N, S, S, 3) uint8 BGR, labels (N, 64) class indices (0 = empty); Newton / IRLS"""
+        X = _design(square_features(boards))
+        y = (np.asarray(labels).reshape(-1) != 0).astype(np.float64)
+        mean, std = X.mean(axis=0), X.std(axis=0) + 1e-6
+        Z = np.hstack([(X - mean) / std, np.ones((len(X), 1))])
+        w = np.zeros(Z.shape[1])
+        reg = l2 * np.eye(Z.shape[1])
+        reg[-1, -1] = 0.0
+        for _ in range(iters):
+            p = 1.0 / (1.0 + np.exp(-Z @ w))
+            H = (Z * (p * (1 - p))[:, None]).T @ Z + reg * len(Z)
+            step = np.linalg.solve(H, Z.T @ (p - y) + reg @ w * len(Z))
+            w -= step
+            if np.abs(step).max() < 1e-6:
+                break
+        return cls(mean, std, w[:-1], w[-1])
+
+    def occupied_prob(self, boards, device=None):
+        """(N, 64) probability that each square is occupied"""
+        z = (_design(square_features(boards, device=device)) - self.mean) / self.std
+        return (1.0 / (1.0 + np.exp(-(z @ self.weights + self.bias)))).reshape(-1, 64)
+
+    def calibrate(self, boards, labels, target_fnr=0.002):
+        """Highest threshold whose false-negative rate on (boards, labels) is <= target_fnr"""
+        prob = self.occupied_prob(boards).reshape(-1)
+        occ = np.sort(prob[np.asarray(labels).reshape(-1) != 0])
+        if len(occ) == 0:
+            raise ValueError("no occupied squares to calibrate on")
+        # Squares strictly below the threshold are called empty: allow floor(target * n) of them
+        k = int(np.floor(target_fnr * len(occ)))
+        self.threshold = float(occ[k])
+        self.target_fnr = float(target_fnr)
+        return self
+
+    def mask(self, boards, device=None):
+        """(N, 64) bool: True = send to the square classifier"""
+        return self.occupied_prob(boards, device=device) >= self.threshold
+
+    def to_dict(self):
+        return {"features": FEATURES, "feature_px": FEATURE_PX, "inner": INNER, "mean": self.mean.tolist(),
+                "std": self.std.tolist(), "weights": self.weights.tolist(), "bias": self.bias,
+                "threshold": self.threshold, "target_fnr": self.target_fnr}
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        if d.get("features") != FEATURES or d.get("feature_px") != FEATURE_PX or d.get("inner") != INNER:
+            raise ValueError(f"{path} was fitted on other features; refit it")
+        return cls(d["mean"], d["std"], d["weights"], d["bias"], d["threshold"], d.get("target_fnr"))
+
+
+def benchmark_cascade(model, prefilter, boards, labels, batch_boards=8, device="cpu"):
+    """Single-stage vs cascade on the same boards: backbone crops per board, ms per board, accuracy"""
+    from square_model import classify_boards
+
+    if getattr(model, "board_level", False):
+        # classify_boards gives board-level models whole boards and ignores the pre-filter
+        raise ValueError("the cascade needs a crop classifier; board-level models (BoardFCN) skip no squares")
+
+    labels = np.asarray(labels).reshape(-1, 64)
+    out = {"boards": len(boards)}
+    for name, pf in [("single_stage", None), ("cascade", prefilter)]:
+        classify_boards(model, boards[:batch_boards], device=device, prefilter=pf)  # warm-up
+        start = time.perf_counter()
+        preds = np.concatenate([classify_boards(model, boards[i:i + batch_boards], device=device, prefilter=pf)
+                                for i in range(0, len(boards), batch_boards)])
+        elapsed = time.perf_counter() - start
+        calls = 64 * len(boards) if pf is None else int(pf.mask(boards).sum())
+        correct = preds == labels
+        out[name] = {"backbone_crops_per_board": calls / len(boards), "ms_per_board": 1000.0 * elapsed / len(boards),
+                     "square_acc": float(correct.mean()), "board_exact": float(correct.all(axis=1).mean())}
+    occ = labels != 0
+    sent = prefilter.mask(boards)
+    out["prefilter"] = {"threshold": prefilter.threshold, "target_fnr": prefilter.target_fnr,
+                        "fnr": float((~sent & occ).sum() / max(1, occ.sum())),
+                        "empty_skipped": float((~sent & ~occ).sum() / max(1, (~occ).sum()))}
+    return out
+
+
+def main():
+    from export_model import load_val_boards
+    from square_model import load_inference_model
+
+    parser = argparse.ArgumentParser(description="Fit, calibrate and benchmark the empty-square pre-filter")
+    parser.add_argument("checkpoint", help="square model used for the cascade benchmark (.pt / .bundle / .ts)")
+    parser.add_argument("--train-games", nargs="+", required=True, help="real game folders to fit on")
+    parser.add_argument("--val-games", nargs="+", required=True, help="real game folders to calibrate / benchmark on")
+    parser.add_argument("--target-fnr", type=float, default=0.002, help="max fraction of occupied squares skipped")
+    parser.add_argument("--max-boards", type=int, default=400, help="boards used per split")
+    parser.add_argument("--out", default="occupancy.json")
+    parser.add_argument("--warp-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    model = load_inference_model(args.checkpoint, device=args.device)
+    if model.board_level:
+        parser.error(f"{args.checkpoint} is a board-level model (BoardFCN, Exp D); the cascade benchmark needs a crop classifier")
+
+    train_boards, train_labels = load_val_boards(args.train_games, args.max_boards, args.warp_workers)
+    val_boards, val_labels = load_val_boards(args.val_games, args.max_boards, args.warp_workers, seed=1)
+    if len(train_boards) == 0 or len(val_boards) < 2:
+        parser.error("not enough boards found")
+    half = len(val_boards) // 2
+    print(f"fit: {len(train_boards)} boards, calibrate: {half}, benchmark: {len(val_boards) - half}")
+
+    prefilter = OccupancyFilter.fit(train_boards, train_labels)
+    prefilter.calibrate(val_boards[:half], val_labels[:half], target_fnr=args.target_fnr)
+    prefilter.save(args.out)
+
+    report = benchmark_cascade(model, prefilter, val_boards[half:], val_labels[half:], device=args.device)
+    with open(os.path.splitext(args.out)[0] + ".benchmark.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    for name in ("single_stage", "cascade"):
+        r = report[name]
+        print(f"{name:>12}: {r['backbone_crops_per_board']:.1f} crops/board, {r['ms_per_board']:.1f} ms/board, "
+              f"square acc {r['square_acc']:.4f}, board exact {r['board_exact']:.4f}")
+    print(f"prefilter: threshold {prefilter.threshold:.4f}, FNR {report['prefilter']['fnr']:.4f} "
+          f"(target {args.target_fnr}), empty squares skipped {report['prefilter']['empty_skipped']:.3f} -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Headless batch inference: the FEN of every chessboard image in folders / globs.
+
+Pipeline stages overlap and results keep the input order:
+    decode + warp   process pool   (file read + cv2.imdecode + preprocess_board_real, CPU bound);
+                                   only the path goes in and the 512 px board comes back, the
+                                   full-resolution image never crosses the process boundary
+    classification  main thread    (--batch-boards boards = B x 64 crops per forward pass)
+
+Writes a CSV with image_path, fen, warp_method. --vis-dir additionally saves the
+warped board with the predicted pieces for every image (off by default).
+With --track the images are the ordered frames of one static-camera game: they
+are warped by a single BoardTracker (reusing the homography between frames)
+instead of the process pool, with decoding on a thread pool (--decode-workers).
+
+Usage:
+    python predict_folder.py best_train.pt "recordings/game2/*.jpg" --out game2_fens.csv
+    python predict_folder.py best_train.pt recordings/game2 --track --vis-dir vis
+    python predict_folder.py exported/best_train.int8.ts recordings/game2 --device cpu
+    python predict_folder.py best_train.fp16.bundle recordings/game2 --prefilter occupancy.json
+"""
+import argparse
+import collections
+import csv
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+from board_localization import BoardTracker, preprocess_board_real
+from occupancy_filter import OccupancyFilter
+from square_model import IDX2FEN, classify_boards, grid_to_fen_placement, load_inference_model
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+BOARD_PX = 512
+
+
+def natural_key(path):
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", path)]
+
+
+def collect_images(inputs):
+    """Directories (not recursive) and glob patterns -> unique image paths in natural order"""
+    paths = []
+    for inp in inputs:
+        if os.path.isdir(inp):
+            paths.extend(os.path.join(inp, name) for name in os.listdir(inp))
+        else:
+            paths.extend(glob.glob(inp))
+    paths = {os.path.abspath(p) for p in paths if p.lower().endswith(IMAGE_EXTS) and os.path.isfile(p)}
+    return sorted(paths, key=natural_key)
+
+
+def decode_image(path):
+    # np.fromfile + imdecode also handles non-ASCII paths on Windows
+    data = np.fromfile(path, dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+
+
+def decode_and_warp(path):
+    """Process pool task: image path -> (board_bgr, method), or (None, "read_fail")"""
+    img_bgr = decode_image(path)
+    if img_bgr is None:
+        return None, "read_fail"
+    board, dbg = preprocess_board_real(img_bgr, out_size=BOARD_PX, fallback=True)
+    return board, dbg.get("method", "?")
+
+
+def decode_ahead(decoders, paths, prefetch):
+    """Yield (path, future of the decoded image) in order, keeping up to `prefetch` decodes in flight"""
+    pending = collections.deque()
+    for path in paths:
+        pending.append((path, decoders.submit(decode_image, path)))
+        if len(pending) >= prefetch:
+            yield pending.popleft()
+    yield from pending
+
+
+def warped_boards(paths, decode_workers=4, warp_workers=4, prefetch=32, track=False):
+    """
+    Yield (path, board_bgr or None, method) in input order. Decoding and warping run
+    ahead of the consumer by up to `prefetch` images, so they overlap with the model
+    stage that consumes this generator. decode_workers: decode threads of --track only.
+    """
+    if track:
+        tracker = BoardTracker(out_size=BOARD_PX)
+        with ThreadPoolExecutor(max_workers=decode_workers) as decoders:
+            for path, fut in decode_ahead(decoders, paths, prefetch):
+                img = fut.result()
+                if img is None:
+                    yield path, None, "read_fail"
+                    continue
+                board, dbg = tracker.warp(img)
+                yield path, board, dbg.get("method", "?")
+        print("Tracking:", {m: tracker.history.count(m) for m in ("tracked", "redetected", "fallback")})
+        return
+
+    with ProcessPoolExecutor(max_workers=warp_workers) as warpers:
+        warping = collections.deque()
+        for path in paths:
+            warping.append((path, warpers.submit(decode_and_warp, path)))
+            if len(warping) >= prefetch:
+                path, fut = warping.popleft()
+                yield (path, *fut.result())
+        for path, fut in warping:
+            yield (path, *fut.result())
+
+
+def save_visualization(board_bgr, grid, out_path):
+    """Warped board with the 8x8 grid and the predicted piece letters (white upper case)"""
+    vis = board_bgr.copy()
+    S = vis.shape[0]
+    step = S / 8.0
+    for i in range(9):
+        p = int(round(i * step))
+        cv2.line(vis, (p, 0), (p, S - 1), (0, 255, 0), 1)
+        cv2.line(vis, (0, p), (S - 1, p), (0, 255, 0), 1)
+    for r in range(8):
+        for c in range(8):
+            ch = IDX2FEN.get(int(grid[r, c]))
+            if ch is None:
+                continue
+            org = (int((c + 0.3) * step), int((r + 0.7) * step))
+            color = (255, 255, 255) if ch.isupper() else (0, 0, 0)
+            outline = (0, 0, 0) if ch.isupper() else (255, 255, 255)
+            cv2.putText(vis, ch, org, cv2.FONT_HERSHEY_SIMPLEX, step / 45.0, outline, 4, cv2.LINE_AA)
+            cv2.putText(vis, ch, org, cv2.FONT_HERSHEY_SIMPLEX, step / 45.0, color, 2, cv2.LINE_AA)
+    cv2.imwrite(out_path, vis)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict the FEN of every chessboard image in folders / globs")
+    parser.add_argument("checkpoint", help="model checkpoint (.pt, e.g. best_train.pt), a .ts / .onnx from export_model.py "
+                                               "or a .bundle from model_bundle.py")
+    parser.add_argument("inputs", nargs="+", help="image directories and/or glob patterns")
+    parser.add_argument("--out", default="predictions.csv", help="output CSV (image_path, fen, warp_method)")
+    parser.add_argument("--batch-boards", type=int, default=8, help="boards per forward pass (x64 crops)")
+    parser.add_argument("--decode-workers", type=int, default=4, help="decode threads with --track (else the warp workers decode)")
+    parser.add_argument("--warp-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--prefetch", type=int, default=32, help="images in flight per stage")
+    parser.add_argument("--track", action="store_true",
+                        help="inputs are ordered frames of one static-camera game: reuse the board homography")
+    parser.add_argument("--vis-dir", default=None, help="also save the warped board with the predicted pieces")
+    parser.add_argument("--prefilter", default=None,
+                        help="occupancy_filter.py JSON: squares it calls empty skip the square model")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        parser.error("no images found")
+    if args.vis_dir:
+        os.makedirs(args.vis_dir, exist_ok=True)
+    model = load_inference_model(args.checkpoint, device=args.device)
+    prefilter = OccupancyFilter.load(args.prefilter) if args.prefilter else None
+    print(f"{len(paths)} images, device={args.device}")
+
+    start = time.time()
+    with open(args.out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image_path", "fen", "warp_method"])
+        batch = []
+
+        def flush():
+            boards = [board for _, board, _ in batch if board is not None]
+            preds = iter(classify_boards(model, np.stack(boards), device=args.device, prefilter=prefilter) if boards else [])
+            for path, board, method in batch:
+                fen = ""
+                if board is not None:
+                    grid = next(preds).reshape(8, 8)
+                    fen = grid_to_fen_placement(grid)
+                    if args.vis_dir:
+                        name = os.path.splitext(os.path.basename(path))[0] + "_pred.png"
+                        save_visualization(board, grid, os.path.join(args.vis_dir, name))
+                writer.writerow([path, fen, method])
+            batch.clear()
+
+        stages = warped_boards(paths, decode_workers=args.decode_workers, warp_workers=args.warp_workers,
+                               prefetch=args.prefetch, track=args.track)
+        for n, item in enumerate(stages, 1):
+            batch.append(item)
+            if len(batch) >= args.batch_boards:
+                flush()
+            if n % 100 == 0:
+                print(f"  {n}/{len(paths)} ({n / (time.time() - start):.2f} img/s)")
+        flush()
+
+    elapsed = time.time() - start
+    print(f"Done: {len(paths)} images in {elapsed:.1f}s ({len(paths) / elapsed:.2f} img/s) -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
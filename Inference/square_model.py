@@ -0,0 +1,429 @@
+"""
+Square classifier side of inference: class table, checkpoint loading and the
+batched 64-square context crops (torch only: ResNets are built without
+torchvision, which is imported only for EfficientNet checkpoints; no OpenCV).
+
+Same code as final_model.ipynb. classify_boards() turns N warped 512x512
+boards into (N, 64) class indices with one crop pass and one forward pass.
+
+Usage:
+    model = load_checkpoint_flexible("best_train.pt", device="cuda")
+    preds = classify_boards(model, np.stack(boards), device="cuda")   # (N, 64) into CLASSES
+    fen = grid_to_fen_placement(preds[0].reshape(8, 8))
+"""
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+CLASSES = ["empty","wP","wN","wB","wR","wQ","wK","bP","bN","bB","bR","bQ","bK"]
+
+IDX2FEN = {
+    0: None,
+    1: "P", 2:"N", 3:"B", 4:"R", 5:"Q", 6:"K",
+    7: "p", 8:"n", 9:"b", 10:"r", 11:"q", 12:"k"
+}
+
+
+def grid_to_fen_placement(grid_idx: np.ndarray) -> str:
+    rows = []
+    for r in range(8):
+        run = 0
+        out = ""
+        for c in range(8):
+            ch = IDX2FEN.get(int(grid_idx[r,c]), None)
+            if ch is None:
+                run += 1
+            else:
+                if run:
+                    out += str(run)
+                    run = 0
+                out += ch
+        if run:
+            out += str(run)
+        rows.append(out)
+    return "/".join(rows)
+
+
+def fen_to_grid(fen: str) -> np.ndarray:
+    """FEN (placement field) -> (8, 8) int64 indices into CLASSES"""
+    fen2idx = {ch: i for i, ch in IDX2FEN.items() if ch is not None}
+    grid = np.zeros((8, 8), dtype=np.int64)
+    for r, row in enumerate(fen.split(" ")[0].split("/")):
+        c = 0
+        for ch in row:
+            if ch.isdigit():
+                c += int(ch)
+            else:
+                grid[r, c] = fen2idx[ch]
+                c += 1
+    return grid
+
+
+# CLASSES index -> index in the submission order returned by predict_board
+CLASS_MAPPING = torch.tensor([12, 0, 2, 3, 1, 4, 5, 6, 8, 9, 7, 10, 11], dtype=torch.int64)
+
+
+class BasicBlock(nn.Module):
+    """torchvision's ResNet BasicBlock (same parameter names)"""
+    def __init__(self, cin: int, cout: int, stride: int = 1):
+        super().__init__()
+        self.conv1 = nn.Conv2d(cin, cout, 3, stride=stride, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(cout)
+        self.relu = nn.ReLU(inplace=True)
+        self.conv2 = nn.Conv2d(cout, cout, 3, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(cout)
+        self.downsample = None
+        if stride != 1 or cin != cout:
+            self.downsample = nn.Sequential(nn.Conv2d(cin, cout, 1, stride=stride, bias=False), nn.BatchNorm2d(cout))
+
+    def forward(self, x):
+        identity = x if self.downsample is None else self.downsample(x)
+        out = self.relu(self.bn1(self.conv1(x)))
+        out = self.bn2(self.conv2(out))
+        return self.relu(out + identity)
+
+
+class ResNet(nn.Module):
+    """
+    torchvision.models.resnet18 / resnet34 (weights=None) without importing torchvision,
+    which takes longer to import than torch itself. State dicts are interchangeable.
+    """
+    def __init__(self, blocks=(2, 2, 2, 2), num_classes: int = 1000):
+        super().__init__()
+        self.conv1 = nn.Conv2d(3, 64, 7, stride=2, padding=3, bias=False)
+        self.bn1 = nn.BatchNorm2d(64)
+        self.relu = nn.ReLU(inplace=True)
+        self.maxpool = nn.MaxPool2d(3, stride=2, padding=1)
+        cin = 64
+        for i, (n, cout) in enumerate(zip(blocks, (64, 128, 256, 512))):
+            layer = [BasicBlock(cin, cout, stride=1 if i == 0 else 2)] + [BasicBlock(cout, cout) for _ in range(n - 1)]
+            setattr(self, f"layer{i + 1}", nn.Sequential(*layer))
+            cin = cout
+        self.avgpool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Linear(512, num_classes)
+        for m in self.modules():
+            if isinstance(m, nn.Conv2d):
+                nn.init.kaiming_normal_(m.weight, mode="fan_out", nonlinearity="relu")
+
+    def forward(self, x):
+        x = self.maxpool(self.relu(self.bn1(self.conv1(x))))
+        x = self.layer4(self.layer3(self.layer2(self.layer1(x))))
+        return self.fc(torch.flatten(self.avgpool(x), 1))
+
+
+class SquareClassifier(nn.Module):
+    def __init__(self, num_classes: int, dropout: float = 0.2, backbone: str = "resnet18"):
+        super().__init__()
+        net = ResNet((3, 4, 6, 3)) if backbone == "resnet34" else ResNet((2, 2, 2, 2))
+        in_features = net.fc.in_features
+        net.fc = nn.Sequential(nn.Dropout(dropout), nn.Linear(in_features, num_classes))
+        self.net = net
+    def forward(self, x):
+        return self.net(x)
+
+
+class EfficientNetSquareClassifier(nn.Module):
+    def __init__(self, num_classes: int, dropout: float = 0.2):
+        super().__init__()
+        import torchvision  # only EfficientNet checkpoints pay for the torchvision import
+        net = torchvision.models.efficientnet_b0(weights=None)
+        in_features = net.classifier[1].in_features
+        net.classifier[1] = nn.Sequential(nn.Dropout(dropout), nn.Linear(in_features, num_classes))
+        self.net = net
+    def forward(self, x):
+        return self.net(x)
+
+
+class BoardFCN(nn.Module):
+    """
+    Board-level model of training_notebook.ipynb (Exp D): the whole warped board (N, 3, S, S),
+    RGB in [0, 1], -> (N, num_classes, 8, 8) logits in one ResNet-18 pass. Normalisation is
+    part of the model (mean / std buffers).
+    """
+    board_level = True
+
+    def __init__(self, num_classes: int, dropout: float = 0.2):
+        super().__init__()
+        net = ResNet((2, 2, 2, 2))
+        net.fc = nn.Identity()
+        self.net = net
+        self.head = nn.Sequential(
+            nn.Conv2d(512, 256, 3, padding=1, bias=False),
+            nn.BatchNorm2d(256),
+            nn.ReLU(inplace=True),
+            nn.Dropout2d(dropout),
+        )
+        self.classifier = nn.Conv2d(256, num_classes, 1)
+        self.register_buffer("mean", torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1))
+        self.register_buffer("std", torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1))
+
+    def forward(self, x):
+        n = self.net
+        x = (x - self.mean) / self.std
+        x = n.maxpool(n.relu(n.bn1(n.conv1(x))))
+        x = n.layer4(n.layer3(n.layer2(n.layer1(x))))
+        x = nn.functional.adaptive_avg_pool2d(self.head(x), 8)
+        return self.classifier(x)
+
+
+def infer_model_type_from_state_dict(sd: dict) -> str:
+    keys = list(sd.keys())
+    if any(k.startswith("classifier.") for k in keys) and any(k.startswith("head.") for k in keys):
+        return "board_fcn"
+    if any(k.startswith("net.layer1.") or k.startswith("net.conv1.") for k in keys) or any(".layer1." in k for k in keys):
+        return "resnet34" if any(".layer1.2." in k for k in keys) else "resnet"
+    if any(k.startswith("net.features.") for k in keys) or any(".features." in k for k in keys):
+        return "efficientnet"
+    return "unknown"
+
+
+def load_checkpoint_flexible(path: str, num_classes: int = len(CLASSES), device="cpu") -> nn.Module:
+    ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    sd = ckpt["model_state"] if isinstance(ckpt, dict) and "model_state" in ckpt else ckpt
+    drop = float(ckpt.get("cfg", {}).get("dropout", 0.2)) if isinstance(ckpt, dict) else 0.2
+
+    mtype = infer_model_type_from_state_dict(sd)
+    if mtype == "board_fcn":
+        model = BoardFCN(num_classes=num_classes, dropout=drop)
+    elif mtype == "efficientnet":
+        model = EfficientNetSquareClassifier(num_classes=num_classes, dropout=drop)
+    else:
+        model = SquareClassifier(num_classes=num_classes, dropout=drop,
+                                 backbone="resnet34" if mtype == "resnet34" else "resnet18")
+
+    incompatible = model.load_state_dict(sd, strict=False)
+    print(f"[{os.path.basename(path)}] model_guess={mtype} | missing={len(incompatible.missing_keys)} unexpected={len(incompatible.unexpected_keys)}")
+    model.preprocess = checkpoint_preprocess(ckpt.get("cfg") if isinstance(ckpt, dict) else None)
+    return model.to(device).eval()
+
+
+# Normalisation of the training notebook's crop models (A.Normalize in build_transforms)
+TRAIN_MEAN = (0.485, 0.456, 0.406)
+TRAIN_STD = (0.229, 0.224, 0.225)
+# Crop preprocessing of checkpoints without it in their cfg (also final_model.ipynb's fallback);
+# bundles carry their own (model_bundle.py)
+DEFAULT_PREPROCESS = {"board_px": 512, "crop_size": 96, "context_k": 1.6,
+                      "mean": TRAIN_MEAN, "std": TRAIN_STD, "channels": "RGB"}
+PREPROCESS_SUFFIX = ".preprocess.json"
+
+
+def checkpoint_preprocess(cfg=None, crop_size=None, context_k=None, mean=None, std=None, board_px=None):
+    """
+    Crop preprocessing a training checkpoint was trained with: crop size / board size cfg["cube"] /
+    cfg["warp"] (else 96 / 512), mean / std cfg["mean"] / cfg["std"] (save_checkpoint) or else
+    the training notebook's ImageNet constants. Explicit arguments win.
+    """
+    cfg = cfg or {}
+    return {"board_px": int(board_px or cfg.get("warp", 512)),
+            "crop_size": int(crop_size or cfg.get("cube", 96)),
+            "context_k": float(context_k or 1.6),
+            "mean": [float(m) for m in (mean or cfg.get("mean") or TRAIN_MEAN)],
+            "std": [float(v) for v in (std or cfg.get("std") or TRAIN_STD)],
+            "channels": "RGB"}
+
+
+def write_preprocess(artifact_path, preprocess):
+    """<artifact>.preprocess.json: the crop preprocessing of an exported .ts / .onnx model"""
+    with open(artifact_path + PREPROCESS_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(preprocess, f, indent=2)
+
+
+def read_preprocess(artifact_path):
+    side = artifact_path + PREPROCESS_SUFFIX
+    if not os.path.exists(side):
+        return None
+    with open(side, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class InferenceModel:
+    """
+    Uniform callable over the runtimes export_model.py / model_bundle.py produce:
+    (N, 3, H, W) float tensor -> (N, num_classes) logits tensor, in CLASSES order.
+    Eager and TorchScript modules get channels-last inputs when channels_last is set;
+    ONNX models run in onnxruntime on the CPU. preprocess: the crop parameters the
+    model expects (classify_boards reads them); class_index: CLASSES order -> output
+    column, for bundles trained with another class order. board_level: the model takes
+    whole boards and returns (N, C, 8, 8) logits (BoardFCN).
+    """
+    def __init__(self, module=None, onnx_session=None, channels_last=False, kind="eager",
+                 preprocess=None, class_index=None, dtype=None):
+        self.module = module
+        self.session = onnx_session
+        self.channels_last = channels_last
+        self.kind = kind
+        self.preprocess = dict(DEFAULT_PREPROCESS, **(preprocess or {}))
+        self.class_index = class_index
+        self.dtype = dtype
+        self.board_level = bool(getattr(module, "board_level", False))
+
+    def __call__(self, x):
+        if self.session is not None:
+            name = self.session.get_inputs()[0].name
+            logits = self.session.run(None, {name: x.detach().float().cpu().numpy()})[0]
+            logits = torch.from_numpy(logits).to(x.device)
+        else:
+            if self.dtype is not None:
+                x = x.to(self.dtype)
+            if self.channels_last:
+                x = x.contiguous(memory_format=torch.channels_last)
+            logits = self.module(x)
+        if self.class_index is not None:
+            logits = logits[:, self.class_index.to(logits.device)]
+        return logits
+
+    def eval(self):
+        return self
+
+
+def load_inference_model(path: str, device="cpu", channels_last=True) -> InferenceModel:
+    """
+    .onnx -> onnxruntime session (needs onnxruntime), .ts -> TorchScript (export_model.py),
+    .bundle -> inference bundle (model_bundle.py), anything else -> training checkpoint
+    via load_checkpoint_flexible. Exported graphs take their preprocessing from the
+    <artifact>.preprocess.json sidecar, checkpoints from their cfg (checkpoint_preprocess).
+    """
+    if path.endswith(".bundle"):
+        from model_bundle import load_bundle
+        return load_bundle(path, device=device, channels_last=channels_last)
+    if path.endswith(".onnx"):
+        import onnxruntime as ort
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        return InferenceModel(onnx_session=session, kind="onnx", preprocess=read_preprocess(path))
+    if path.endswith(".ts"):
+        module = torch.jit.load(path, map_location=device).eval()
+        return InferenceModel(module, channels_last=channels_last, kind="torchscript", preprocess=read_preprocess(path))
+    module = load_checkpoint_flexible(path, device=device)
+    if channels_last:
+        module = module.to(memory_format=torch.channels_last)
+    return InferenceModel(module, channels_last=channels_last, kind="eager", preprocess=module.preprocess)
+
+
+def context_crop_boxes(S, k, board_guard=0.0, slack_sq=None):
+    """
+    Integer crop boxes (xa, xb, ya, yb), each (N, 64), for per-square context factors k (N, 64).
+    Same rounding and clipping as crop_context_square_from_board (slack_sq: optional edge clamping of the training crops).
+    """
+    k = np.asarray(k, dtype=np.float64).reshape(-1, 64)
+    guard = int(round(S * board_guard))
+    U0, U1 = guard, S - guard
+    if U1 - U0 < 64:
+        U0, U1 = 0, S
+    sq = (U1 - U0) / 8.0
+    rr, cc = np.divmod(np.arange(64), 8)
+    cx = U0 + (cc + 0.5) * sq
+    cy = U0 + (rr + 0.5) * sq
+    half = 0.5 * k * sq
+    if slack_sq is not None:
+        max_half = np.minimum.reduce([cx - U0, U1 - cx, cy - U0, U1 - cy]) + slack_sq * sq
+        half = np.minimum(half, max_half)
+    xa = np.clip(np.round(cx - half), 0, S - 2)
+    ya = np.clip(np.round(cy - half), 0, S - 2)
+    xb = np.maximum(xa + 1, np.minimum(S - 1, np.round(cx + half)))
+    yb = np.maximum(ya + 1, np.minimum(S - 1, np.round(cy + half)))
+    return xa, xb, ya, yb
+
+
+def batch_context_crops(boards, k=1.6, out_size=96, mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5),
+                        board_guard=0.0, slack_sq=None, device=None):
+    """
+    All 64 context crops of N warped boards in one resampling pass.
+    boards: (N, S, S, 3) uint8 BGR (numpy or tensor); k: scalar, (N,) or (N, 64).
+    Returns (N*64, 3, out_size, out_size) float32, RGB, normalised with mean/std, in square order r*8+c.
+    Matches final_model.ipynb's extract_64_cubes + cvtColor + TF_EVAL to <1 gray level on average
+    (bilinear resampling instead of cv2's INTER_AREA / INTER_CUBIC; differences only at sharp edges).
+    """
+    x = boards if torch.is_tensor(boards) else torch.from_numpy(np.ascontiguousarray(boards))
+    if device is not None:
+        x = x.to(device, non_blocking=True)
+    dev = x.device
+    N, S = x.shape[0], x.shape[1]
+    k = np.asarray(k, dtype=np.float64)
+    k = np.broadcast_to(k.reshape(-1, 1) if k.ndim <= 1 else k, (N, 64))
+    xa, xb, ya, yb = context_crop_boxes(S, k, board_guard=board_guard, slack_sq=slack_sq)
+
+    # BGR->RGB and normalisation on the boards (fewer pixels than the crops; resampling is linear)
+    mean_t = torch.tensor(mean, device=dev, dtype=torch.float32).view(1, 3, 1, 1) * 255.0
+    std_t = torch.tensor(std, device=dev, dtype=torch.float32).view(1, 3, 1, 1) * 255.0
+    img = (x[..., [2, 1, 0]].permute(0, 3, 1, 2).float() - mean_t) / std_t
+
+    # cv2.resize samples dst pixel i at src a + (i + 0.5) * (b - a) / out (pixel-edge coordinates);
+    # grid_sample with align_corners=False uses the same convention on [-1, 1]
+    t = (torch.arange(out_size, device=dev, dtype=torch.float64) + 0.5) / out_size
+    def axis(a, b):
+        a = torch.as_tensor(a, device=dev).reshape(N, 64, 1)
+        b = torch.as_tensor(b, device=dev).reshape(N, 64, 1)
+        return (2.0 * (a + t * (b - a)) / S - 1.0).float()
+    gx, gy = axis(xa, xb), axis(ya, yb)  # (N, 64, out)
+    # The 64 crops of a board are stacked vertically into one (64*out, out) sampling grid
+    grid = torch.stack(torch.broadcast_tensors(gx[:, :, None, :], gy[:, :, :, None]), dim=-1)
+    grid = grid.reshape(N, 64 * out_size, out_size, 2)
+
+    crops = torch.nn.functional.grid_sample(img, grid, mode="bilinear", padding_mode="border", align_corners=False)
+    return crops.reshape(N, 3, 64, out_size, out_size).permute(0, 2, 1, 3, 4).reshape(N * 64, 3, out_size, out_size)
+
+
+def board_batch(boards, size=512, device=None):
+    """(N, S, S, 3) uint8 BGR boards (numpy or tensor) -> (N, 3, size, size) float32 RGB in [0, 1]"""
+    x = boards if torch.is_tensor(boards) else torch.from_numpy(np.ascontiguousarray(boards))
+    if device is not None:
+        x = x.to(device, non_blocking=True)
+    x = x[..., [2, 1, 0]].permute(0, 3, 1, 2).float() / 255.0
+    if x.shape[-1] != size:
+        x = nn.functional.interpolate(x, size=(size, size), mode="bilinear", align_corners=False, antialias=True)
+    return x
+
+
+def classify_boards(model, boards, k=None, out_size=None, device="cpu", max_crops=1024, mean=None, std=None,
+                    with_confidence=False, prefilter=None):
+    """
+    boards: (N, S, S, 3) uint8 BGR warped boards -> (N, 64) int64 numpy class indices (into CLASSES),
+    plus the (N, 64) float32 softmax probability of each predicted class if with_confidence.
+    Crops are forwarded in chunks of at most max_crops (whole boards per chunk).
+    k / out_size / mean / std default to the model's preprocess config (InferenceModel),
+    else to DEFAULT_PREPROCESS. Board-level models (BoardFCN) get the whole boards instead:
+    one forward pass per board, no crops.
+    prefilter: optional occupancy_filter.OccupancyFilter (crop models only); squares it calls
+    empty skip the model and are predicted "empty" (confidence 1 - occupancy probability).
+    """
+    pre = getattr(model, "preprocess", DEFAULT_PREPROCESS)
+    k = pre["context_k"] if k is None else k
+    out_size = pre["crop_size"] if out_size is None else out_size
+    mean = pre["mean"] if mean is None else mean
+    std = pre["std"] if std is None else std
+    per_chunk = max(1, max_crops // 64)
+    preds, confs = [], []
+    with torch.inference_mode():
+        for i in range(0, len(boards), per_chunk):
+            chunk = boards[i:i + per_chunk]
+            if getattr(model, "board_level", False):
+                x = board_batch(chunk, size=pre["board_px"], device=device)
+                prefilter_prob = None
+            else:
+                x = batch_context_crops(chunk, k=k, out_size=out_size, mean=mean, std=std, device=device)
+                prefilter_prob = None if prefilter is None else prefilter.occupied_prob(chunk, device=device)
+            if prefilter_prob is not None:
+                send = torch.from_numpy(prefilter_prob.reshape(-1) >= prefilter.threshold)
+                pred = torch.zeros(len(send), dtype=torch.int64)   # CLASSES[0] == "empty"
+                conf = torch.from_numpy(1.0 - prefilter_prob.reshape(-1)).float()
+                if send.any():
+                    with torch.autocast("cuda", enabled=x.is_cuda):
+                        logits = model(x[send.to(x.device)])
+                    conf[send], pred[send] = (t.cpu() for t in logits.float().softmax(dim=1).max(dim=1))
+                preds.append(pred.view(-1, 64))
+                confs.append(conf.view(-1, 64))
+                continue
+            with torch.autocast("cuda", enabled=x.is_cuda):
+                logits = model(x)
+            if logits.dim() == 4:
+                # (B, C, 8, 8) -> (B*64, C) in square order r*8+c
+                logits = logits.permute(0, 2, 3, 1).reshape(-1, logits.shape[1])
+            conf, pred = logits.float().softmax(dim=1).max(dim=1)
+            preds.append(pred.view(-1, 64).cpu())
+            confs.append(conf.view(-1, 64).cpu())
+    if with_confidence:
+        return torch.cat(preds).numpy(), torch.cat(confs).numpy()
+    return torch.cat(preds).numpy()
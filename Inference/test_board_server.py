@@ -0,0 +1,152 @@
+"""
+End-to-end tests of board_server.py: a real BoardServer on a free localhost port and on a
+Unix socket, synthetic board images POSTed by concurrent clients, a tiny crop model.
+
+Usage (from Inference/):
+    python -m pytest test_board_server.py
+    python -m unittest test_board_server
+"""
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+import torch.nn as nn
+
+from board_server import BATCH_BUCKETS, LATENCY_BUCKETS_MS, MAX_BODY_BYTES, BoardServer
+from square_model import CLASSES, InferenceModel
+
+N_CLIENTS = 8
+
+
+def tiny_model():
+    """Untrained crop classifier on 32 px crops: the tests check the serving path, not the predictions"""
+    net = nn.Sequential(nn.Conv2d(3, 8, 3, stride=2), nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(8, len(CLASSES)))
+    return InferenceModel(net.eval(), kind="eager", preprocess={"crop_size": 32})
+
+
+def synthetic_board(seed, px=640):
+    """PNG bytes of an 8x8 checkerboard on a darker border, with a few random discs as pieces"""
+    rng = np.random.default_rng(seed)
+    img = np.full((px, px, 3), 40, np.uint8)
+    margin, sq = px // 10, (px - 2 * (px // 10)) // 8
+    for r in range(8):
+        for c in range(8):
+            shade = 200 if (r + c) % 2 == 0 else 110
+            img[margin + r * sq:margin + (r + 1) * sq, margin + c * sq:margin + (c + 1) * sq] = shade
+    for r, c in rng.integers(0, 8, size=(6, 2)):
+        center = (int(margin + c * sq + sq // 2), int(margin + r * sq + sq // 2))
+        cv2.circle(img, center, sq // 3, tuple(int(v) for v in rng.integers(0, 255, 3)), -1)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+async def http(connect, method, path, body=b"", headers=None):
+    """One request on a fresh connection -> (status, json payload)"""
+    reader, writer = await connect()
+    head = {"Host": "localhost", "Content-Length": str(len(body)), "Connection": "close", **(headers or {})}
+    writer.write((f"{method} {path} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in head.items())
+                  + "\r\n").encode("latin-1") + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    payload = json.loads(await reader.readexactly(length))
+    writer.close()
+    return int(status_line.split()[1]), payload
+
+
+class BoardServerTest(unittest.TestCase):
+    def run_server(self, scenario, unix=None, **kwargs):
+        """Starts a BoardServer (port 0 or unix), runs scenario(server, connect) against it, then cancels it"""
+        server = BoardServer(tiny_model(), device="cpu", model_name="tiny", **kwargs)
+
+        async def main():
+            ready = asyncio.Event()
+            serving = asyncio.create_task(server.serve(host="127.0.0.1", port=0, unix=unix, ready=ready))
+            await asyncio.wait_for(ready.wait(), 30)
+            if unix:
+                connect = lambda: asyncio.open_unix_connection(unix)  # noqa: E731
+            else:
+                connect = lambda: asyncio.open_connection(*server.address)  # noqa: E731
+            try:
+                return await scenario(server, connect)
+            finally:
+                serving.cancel()
+                await asyncio.gather(serving, return_exceptions=True)
+
+        return asyncio.run(main())
+
+    def test_concurrent_posts_are_batched(self):
+        async def scenario(server, connect):
+            self.assertNotEqual(server.address[1], 0)
+            results = await asyncio.gather(*[http(connect, "POST", "/predict", synthetic_board(i))
+                                             for i in range(N_CLIENTS)])
+            return results, (await http(connect, "GET", "/metrics"))[1]
+
+        # A long wait window: boards warped while a batch is open join it
+        results, metrics = self.run_server(scenario, warp_workers=2, max_batch=N_CLIENTS, max_wait_ms=1000)
+        for status, payload in results:
+            self.assertEqual(status, 200, payload)
+            self.assertEqual(len(payload["squares"]), 8)
+            self.assertTrue(all(name in CLASSES for row in payload["squares"] for name in row))
+            self.assertEqual(len(payload["fen"].split("/")), 8)
+            self.assertTrue(0.0 <= payload["min_confidence"] <= 1.0)
+
+        batches = metrics["batch_size"]
+        self.assertEqual(len(batches["buckets"]), len(BATCH_BUCKETS) + 1)
+        self.assertLess(batches["count"], N_CLIENTS, "every board had a forward pass of its own")
+        self.assertAlmostEqual(batches["mean"] * batches["count"], N_CLIENTS)
+        self.assertEqual(metrics["requests"], N_CLIENTS + 1)   # the /metrics request itself counts
+        self.assertEqual(metrics["errors"], 0)
+        self.assertEqual(sum(metrics["warp_methods"].values()), N_CLIENTS)
+        for stage in ("total", "warp", "queue", "model"):
+            hist = metrics["latency_ms"][stage]
+            self.assertEqual(hist["count"], N_CLIENTS, stage)
+            self.assertEqual(sum(hist["buckets"].values()), N_CLIENTS, stage)
+            self.assertEqual(len(hist["buckets"]), len(LATENCY_BUCKETS_MS) + 1, stage)
+
+    def test_unix_socket_routes(self):
+        async def scenario(server, connect):
+            return {
+                "healthz": await http(connect, "GET", "/healthz"),
+                "predict": await http(connect, "POST", "/predict", synthetic_board(0)),
+                "get_predict": await http(connect, "GET", "/predict"),
+                "empty": await http(connect, "POST", "/predict"),
+                "not_an_image": await http(connect, "POST", "/predict", b"not an image"),
+                "unknown": await http(connect, "GET", "/nope"),
+                "too_large": await http(connect, "POST", "/predict", headers={"Content-Length": str(MAX_BODY_BYTES + 1)}),
+                "metrics": await http(connect, "GET", "/metrics"),
+            }
+
+        with tempfile.TemporaryDirectory() as tmp:
+            sock = os.path.join(tmp, "board.sock")
+            out = self.run_server(scenario, unix=sock, warp_workers=1, max_batch=4, max_wait_ms=5)
+            self.assertFalse(os.path.exists(sock), "socket file left behind")
+
+        self.assertEqual(out["healthz"], (200, {"ok": True, "model": "tiny"}))
+        self.assertEqual(out["predict"][0], 200)
+        self.assertEqual(out["get_predict"][0], 405)
+        self.assertEqual(out["empty"][0], 400)
+        self.assertEqual(out["not_an_image"][0], 422)
+        self.assertEqual(out["not_an_image"][1]["warp_method"], "decode_fail")
+        self.assertEqual(out["unknown"][0], 404)
+        self.assertEqual(out["too_large"][0], 413)
+
+        metrics = out["metrics"][1]
+        self.assertEqual(metrics["errors"], 5)
+        self.assertEqual(metrics["batch_size"]["count"], 1)
+        self.assertEqual(metrics["latency_ms"]["total"]["count"], 1)
+        self.assertEqual(metrics["warp_methods"].get("decode_fail"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()